@@ -0,0 +1,210 @@
+from itertools import count
+from math import isfinite
+
+from lexer import TokenType
+from parser import *
+
+
+# Operators that keep their meaning as Python syntax on the typed int path
+python_binary_ops = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.MULTIPLY: "*",
+    TokenType.DIVIDE: "/",
+    TokenType.MODULO: "%",
+    TokenType.EQUAL_EQUAL: "==",
+    TokenType.BANG_EQUAL: "!=",
+    TokenType.GREATER: ">",
+    TokenType.LESS: "<",
+    TokenType.GREATER_EQUAL: ">=",
+    TokenType.LESS_EQUAL: "<=",
+    TokenType.BIT_OR: "|",
+    TokenType.BIT_XOR: "^",
+    TokenType.BIT_AND: "&",
+    TokenType.BIT_LSH: "<<",
+    TokenType.BIT_RSH: ">>",
+}
+
+python_unary_ops = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.BIT_NOT: "~",
+}
+
+
+class BodyGenerator:
+    """
+    Translates a resolved function body into the source of one Python function.
+
+    The generated `body(frame)` keeps the frame's slot list in a local and
+    writes slotted variables, int arithmetic, branches and loops as plain
+    Python, so CPython runs them as bytecode. Anything with its own runtime
+    semantics (generic operators, blocks with their own scope, dict-bound
+    names) calls the node's compiled closure with the frame instead. Each
+    statement leaves its value in `r`, which is what the body returns.
+
+    The source refers to the names in `bindings` and to the helpers of the
+    runtime module, so it is executed with those as globals. Call sites that
+    look their callee up by name are listed in `called_names`.
+    """
+
+    def __init__(self, compile):
+        self.compile = compile
+        self.lines = []
+        self.bindings = {}
+        self.called_names = set()
+        self.ids = count()
+
+    def bind(self, prefix, value) -> str:
+        name = f"{prefix}{next(self.ids)}"
+        self.bindings[name] = value
+        return name
+
+    def emit(self, line, depth) -> None:
+        self.lines.append("    " * depth + line)
+
+    def literal(self, value) -> str:
+        # Infinities and ints too long to convert to text have no source form
+        if (type(value) is float and not isfinite(value)) or (
+            type(value) is int and value.bit_length() > 64
+        ):
+            return self.bind("k", value)
+        return repr(value)
+
+    def delegate(self, node) -> str:
+        return f"{self.bind('c', self.compile(node))}(frame)"
+
+    def expression(self, node) -> str:
+        node_type = type(node)
+
+        if node_type in literal_nodes:
+            return self.literal(node.value)
+        if node_type is LocalRefNode:
+            return f"s[{node.slot}]"
+        if node_type is IdentifierNode:
+            return f"frame.lookup({node.name!r})"
+        if node_type is ReturnNode:
+            return self.expression(node.value)
+
+        if node_type is UnaryOpNode and node.op in python_unary_ops:
+            return f"({python_unary_ops[node.op]}{self.expression(node.expr)})"
+
+        if node_type is TypedBinaryOpNode:
+            divisor = node.right
+            if not node.checks_zero or (
+                type(divisor) is NumberNode and divisor.value != 0
+            ):
+                left = self.expression(node.left)
+                right = self.expression(node.right)
+                return f"({left} {python_binary_ops[node.op]} {right})"
+
+        if node_type is BinaryOpNode and node.op == TokenType.LOGICAL_AND:
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            return f"({right} if {left} else False)"
+        if node_type is BinaryOpNode and node.op == TokenType.LOGICAL_OR:
+            left = self.expression(node.left)
+            right = self.expression(node.right)
+            return f"(True if {left} else {right})"
+
+        if node_type is FunctionCallNode:
+            temp = next(self.ids)
+            callee = f"t{temp}"
+            site = self.bind("n", node)
+            if node.slot is not None:
+                load = f"s[{node.slot}]"
+            else:
+                self.called_names.add(node.name)
+                load = (
+                    f"({site}.cache[2] if {site}.cache[1] is frame"
+                    f" and {site}.cache[0] == Scope._bindings_version"
+                    f" else call_target({site}, frame))"
+                )
+            arguments = ", ".join(self.expression(arg) for arg in node.arguments)
+            if len(node.arguments) == 1:
+                # The argument is written once, after the callee is checked,
+                # so nested calls don't multiply the source
+                one, listed = f"o{temp}", f"a{temp}"
+                return (
+                    f"({callee}.call_one({listed}[0])"
+                    f" if (({one} := type({callee} := {load}) is BuiltInFunction"
+                    f" and {callee}.call_one is not None)"
+                    f" or type({callee}) is UserFunction"
+                    f" or type({callee}) is BuiltInFunction"
+                    f" or not_callable({site}, frame))"
+                    f" and ({listed} := [{arguments}]) and {one}"
+                    f" else {callee}({listed}))"
+                )
+            return (
+                f"({callee} if type({callee} := {load}) is UserFunction"
+                f" or type({callee}) is BuiltInFunction"
+                f" else not_callable({site}, frame))([{arguments}])"
+            )
+
+        if node_type is ArrayAccessNode:
+            site = self.bind("n", node)
+            array = self.expression(node.array)
+            index = self.expression(node.index)
+            return f"load_item({site}, frame, {array}, {index})"
+        if node_type is ArrayAssignmentNode:
+            site = self.bind("n", node)
+            array = self.expression(node.array)
+            index = self.expression(node.index)
+            value = self.expression(node.value)
+            return f"store_item({site}, frame, {array}, {index}, {value})"
+
+        return self.delegate(node)
+
+    def statement(self, node, depth) -> None:
+        node_type = type(node)
+
+        if node_type is VariableDeclarationNode and node.slot is not None:
+            self.emit(f"r = s[{node.slot}] = {self.expression(node.value)}", depth)
+        elif node_type is VariableAssignmentNode and node.slot is not None:
+            self.emit(f"r = s[{node.slot}] = {self.expression(node.value)}", depth)
+            self.emit(f'print(f"{node.name} = {{r}}")', depth)
+        elif node_type is IfNode and not node._introduces_scope:
+            self.emit(f"if {self.expression(node.condition)}:", depth)
+            self.block(node.body, depth + 1)
+            self.emit("else:", depth)
+            self.block(node.else_body or [], depth + 1)
+        elif node_type is WhileNode and not node._introduces_scope:
+            self.loop(node, depth)
+        else:
+            self.emit(f"r = {self.expression(node)}", depth)
+
+    def block(self, statements, depth) -> None:
+        if not statements:
+            self.emit("r = None", depth)
+        for statement in statements:
+            self.statement(statement, depth)
+
+    def loop(self, node, depth) -> None:
+        # Mirrors Runtime._compile_while, including the iteration limit
+        return_index = first_return(node.body)
+        body = node.body[: return_index + 1]
+        condition = self.expression(node.condition)
+
+        self.emit("r = None", depth)
+        if return_index < len(node.body):
+            self.emit(f"if {condition}:", depth)
+            self.block(body, depth + 1)
+            return
+
+        counter = f"i{next(self.ids)}"
+        self.emit(f"{counter} = 0", depth)
+        self.emit(f"while {condition}:", depth)
+        self.block(body, depth + 1)
+        self.emit(f"{counter} += 1", depth + 1)
+        self.emit(f"if {counter} > 1000:", depth + 1)
+        self.emit(
+            'raise RuntimeError("Maximum iteration limit reached")', depth + 2
+        )
+
+    def function(self, statements) -> str:
+        self.emit("def body(frame):", 0)
+        self.emit("s = frame.slots", 1)
+        self.block(statements, 1)
+        self.emit("return r", 1)
+        return "\n".join(self.lines)
+
@@ -0,0 +1,435 @@
+import operator
+from math import copysign
+from sys import intern
+
+from lexer import TokenType
+from parser import *
+
+
+def operator_table(operators) -> tuple:
+    """Flatten a TokenType -> function mapping into a tuple indexed by token."""
+    table = [None] * (max(TokenType) + 1)
+    for token_type, operation in operators.items():
+        table[token_type] = operation
+    return tuple(table)
+
+
+# Operator implementations, resolved once per node at compile time
+binary_operators = operator_table(
+    {
+        TokenType.PLUS: operator.add,
+        TokenType.MINUS: operator.sub,
+        TokenType.MULTIPLY: operator.mul,
+        TokenType.DIVIDE: operator.truediv,
+        TokenType.MODULO: operator.mod,
+        TokenType.EQUAL_EQUAL: operator.eq,
+        TokenType.BANG_EQUAL: operator.ne,
+        TokenType.GREATER: operator.gt,
+        TokenType.LESS: operator.lt,
+        TokenType.GREATER_EQUAL: operator.ge,
+        TokenType.LESS_EQUAL: operator.le,
+        TokenType.BIT_OR: operator.or_,
+        TokenType.BIT_XOR: operator.xor,
+        TokenType.BIT_AND: operator.and_,
+        TokenType.BIT_LSH: operator.lshift,
+        TokenType.BIT_RSH: operator.rshift,
+    }
+)
+
+unary_operators = operator_table(
+    {
+        TokenType.PLUS: operator.pos,
+        TokenType.MINUS: operator.neg,
+        TokenType.BIT_NOT: operator.invert,
+    }
+)
+
+
+# Opcodes. Every instruction has one argument, which is an index into the
+# code's constants unless noted otherwise. Runtime.run_code handles the
+# ones that move the program counter or switch scopes itself; the rest
+# only work on the stack and start at FIRST_HANDLED, so that it can hand
+# them to a handler table after a single comparison
+(
+    LOAD_LOCAL,  # slot
+    LOAD_CONST,
+    LOAD_NAME,  # name index
+    BINARY_INT_CONST,
+    BINARY_INT,
+    BINARY_CONST,
+    BINARY,
+    LOOP_TEST,  # target
+    JUMP_IF_FALSE,  # target
+    POP_TOP,
+    JUMP,  # target
+    STORE_LOCAL_POP,  # slot
+    DEFINE_NAME_POP,  # name index
+    LOOP_NEXT,  # target
+    STORE_LOCAL,  # slot
+    DEFINE_NAME,  # name index
+    CALL,  # argument count
+    RETURN,
+    ENTER_SCOPE,  # scope kind
+    LEAVE_SCOPE,  # scope kind
+    AND_JUMP,  # target
+    OR_JUMP,  # target
+    HALT,
+    ASSIGN_LOCAL,
+    ASSIGN_NAME,  # name index
+    LOOP_TICK,
+    LOOP_EXIT,
+    GET_CALLEE,
+    BINARY_INT_CHECKED,
+    UNARY,
+    ARRAY_GET,
+    ARRAY_SET,
+    COPY_CONST,
+    BUILD_ARRAY,  # element count
+    INPLACE_ADD,
+    INPLACE_SUB,
+    MAKE_FUNCTION,
+    FAIL,
+) = range(38)
+
+FIRST_HANDLED = ASSIGN_LOCAL
+
+# Block scope kinds, see Runtime._block_scope_hooks
+FRESH_SCOPE = 1
+POOLED_SCOPE = 2
+
+
+class CompileError(Exception):
+    def __init__(self, message: str, node=None):
+        super().__init__(message)
+        self.message = message
+        self.node = node
+
+
+class Code:
+    """A compiled program or function body: parallel op/arg lists and constants."""
+
+    __slots__ = ("ops", "args", "consts", "names")
+
+    def __init__(self, ops, args, consts, names):
+        self.ops = ops
+        self.args = args
+        self.consts = consts
+        # Interned variable names, so scope dict probes mostly compare by identity
+        self.names = names
+
+
+class Compiler:
+    """
+    Lowers resolved ASTs to flat code for Runtime.run_code.
+
+    Every node leaves exactly one value on the stack, so a block pops all
+    but its last statement's value, matching how the closures return the
+    value of the last statement run.
+    """
+
+    def __init__(self, called_names=None):
+        self.ops = []
+        self.args = []
+        self.consts = []
+        # Literal -> index, so each distinct literal is stored once
+        self.literals = {}
+        self.names = {}
+        # Jump targets, which must stay at the start of an instruction
+        self.labels = set()
+        # Names looked up by call sites, which the runtime tracks for caching
+        self.called_names = set() if called_names is None else called_names
+
+    def emit(self, op, arg=0) -> int:
+        if self.ops and len(self.ops) not in self.labels:
+            fused = self.fuse(op, arg)
+            if fused is not None:
+                self.ops[-1], self.args[-1] = fused
+                return len(self.ops) - 1
+        self.ops.append(op)
+        self.args.append(arg)
+        return len(self.ops) - 1
+
+    def fuse(self, op, arg):
+        """A superinstruction doing the last instruction and this one, if any."""
+        last, last_arg = self.ops[-1], self.args[-1]
+        if last == LOAD_CONST:
+            value = self.consts[last_arg]
+            if op == BINARY_INT:
+                return BINARY_INT_CONST, self.const((self.consts[arg], value))
+            if op == BINARY:
+                operation, node = self.consts[arg]
+                return BINARY_CONST, self.const((operation, node, value))
+        elif op == POP_TOP:
+            if last == DEFINE_NAME:
+                return DEFINE_NAME_POP, last_arg
+            if last == STORE_LOCAL:
+                return STORE_LOCAL_POP, last_arg
+            if last == JUMP_IF_FALSE:
+                return LOOP_TEST, last_arg
+        elif op == JUMP and last == LOOP_TICK:
+            return LOOP_NEXT, arg
+        return None
+
+    def label(self) -> int:
+        """Mark the next instruction as a jump target."""
+        self.labels.add(len(self.ops))
+        return len(self.ops)
+
+    def const(self, value) -> int:
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def literal(self, value) -> int:
+        # Keyed on type so that 1, 1.0 and True stay apart, and on the sign of
+        # floats so that 0.0 and -0.0 do. A NaN never matches a key, so each
+        # one simply gets its own constant.
+        if type(value) is float:
+            key = (float, value, copysign(1.0, value))
+        else:
+            key = (type(value), value)
+        index = self.literals.get(key)
+        if index is None:
+            index = self.literals[key] = self.const(value)
+        return index
+
+    def name(self, name) -> int:
+        return self.names.setdefault(intern(name), len(self.names))
+
+    def patch(self, index) -> None:
+        """Point the jump at `index` to the next instruction."""
+        self.args[index] = self.label()
+
+    def code(self) -> Code:
+        return Code(self.ops, self.args, tuple(self.consts), tuple(self.names))
+
+    def program(self, statements) -> Code:
+        self.block(statements)
+        self.emit(HALT)
+        return self.code()
+
+    def function(self, node) -> Code:
+        # Statements after the first top-level return are never reached
+        self.block(node.body[: first_return(node.body) + 1])
+        self.emit(RETURN)
+        return self.code()
+
+    def block(self, statements) -> None:
+        if not statements:
+            self.emit(LOAD_CONST, self.literal(None))
+            return
+        for index, statement in enumerate(statements):
+            if index:
+                self.emit(POP_TOP)
+            self.node(statement)
+
+    def scoped_block(self, node, statements) -> None:
+        kind = scope_kind(node)
+        if kind:
+            self.emit(ENTER_SCOPE, kind)
+        self.block(statements)
+        if kind:
+            self.emit(LEAVE_SCOPE, kind)
+
+    def node(self, node) -> None:
+        compiler = self._COMPILERS.get(type(node))
+        if compiler is None:
+            raise CompileError(f"Unsupported node type: {type(node).__name__}", node)
+        compiler(self, node)
+
+    def _constant(self, node) -> None:
+        self.emit(LOAD_CONST, self.literal(node.value))
+
+    def _char(self, node) -> None:
+        self.emit(LOAD_CONST, self.literal(chr(node.value)))
+
+    def _identifier(self, node) -> None:
+        self.emit(LOAD_NAME, self.name(node.name))
+
+    def _local_ref(self, node) -> None:
+        self.emit(LOAD_LOCAL, node.slot)
+
+    def _array(self, node) -> None:
+        if node._precomputed_list is not None:
+            # Arrays are mutable, so every evaluation gets its own copy
+            self.emit(COPY_CONST, self.const(node._precomputed_list))
+            return
+        for element in node.elements:
+            self.node(element)
+        self.emit(BUILD_ARRAY, len(node.elements))
+
+    def _array_access(self, node) -> None:
+        self.node(node.array)
+        self.node(node.index)
+        self.emit(ARRAY_GET, self.const(node))
+
+    def _array_assignment(self, node) -> None:
+        self.node(node.array)
+        self.node(node.index)
+        self.node(node.value)
+        self.emit(ARRAY_SET, self.const(node))
+
+    def _unary_op(self, node) -> None:
+        operation = unary_operators[node.op]
+        self.node(node.expr)
+        if operation is None:
+            # Only an error once it runs, like the closures
+            message = f"Unsupported unary operation: {node.op}"
+            self.emit(FAIL, self.const((message, node)))
+            return
+        self.emit(UNARY, self.const(operation))
+
+    def _binary_op(self, node) -> None:
+        op = node.op
+        if op in (TokenType.PLUS_EQUAL, TokenType.MINUS_EQUAL):
+            self._compound_assignment(node)
+            return
+
+        if op in (TokenType.LOGICAL_AND, TokenType.LOGICAL_OR):
+            self.node(node.left)
+            jump = self.emit(AND_JUMP if op == TokenType.LOGICAL_AND else OR_JUMP)
+            self.node(node.right)
+            self.patch(jump)
+            return
+
+        operation = binary_operators[op]
+        self.node(node.left)
+        self.node(node.right)
+        if operation is None:
+            message = f"Unsupported binary operation: {op}"
+            self.emit(FAIL, self.const((message, node)))
+            return
+        self.emit(BINARY, self.const((operation, node)))
+
+    def _typed_binary_op(self, node) -> None:
+        # Both operands are known ints, so only a zero divisor can fail
+        operation = binary_operators[node.op]
+        self.node(node.left)
+        self.node(node.right)
+        divisor = node.right
+        if node.checks_zero and not (
+            type(divisor) is NumberNode and divisor.value != 0
+        ):
+            self.emit(BINARY_INT_CHECKED, self.const((operation, node)))
+        else:
+            self.emit(BINARY_INT, self.const(operation))
+
+    def _compound_assignment(self, node) -> None:
+        if not isinstance(node.left, IdentifierNode):
+            raise CompileError(
+                "Left side of compound assignment must be a variable", node
+            )
+        self.node(node.left)
+        self.node(node.right)
+        op = INPLACE_ADD if node.op == TokenType.PLUS_EQUAL else INPLACE_SUB
+        self.emit(op, self.const(node))
+        self.store(node.left.name, node.left.slot)
+
+    def store(self, name, slot) -> None:
+        if slot is None:
+            self.emit(ASSIGN_NAME, self.name(name))
+        else:
+            self.emit(ASSIGN_LOCAL, self.const((name, slot)))
+
+    def _function_call(self, node) -> None:
+        if node.slot is None:
+            self.called_names.add(node.name)
+        self.emit(GET_CALLEE, self.const(node))
+        for argument in node.arguments:
+            self.node(argument)
+        self.emit(CALL, len(node.arguments))
+
+    def _function_declaration(self, node) -> None:
+        code = Compiler(self.called_names).function(node)
+        self.emit(MAKE_FUNCTION, self.const((node, code)))
+
+    def _return(self, node) -> None:
+        self.node(node.value)
+
+    def _var_declaration(self, node) -> None:
+        self.node(node.value)
+        if node.slot is None:
+            self.emit(DEFINE_NAME, self.name(node.name))
+        else:
+            self.emit(STORE_LOCAL, node.slot)
+
+    def _var_assignment(self, node) -> None:
+        self.node(node.value)
+        self.store(node.name, node.slot)
+
+    def _if(self, node) -> None:
+        self.node(node.condition)
+        to_else = self.emit(JUMP_IF_FALSE)
+        self.scoped_block(node, node.body)
+        to_end = self.emit(JUMP)
+        self.patch(to_else)
+        if node.else_body is None:
+            self.emit(LOAD_CONST, self.literal(None))
+        else:
+            self.scoped_block(node, node.else_body)
+        self.patch(to_end)
+
+    def _while(self, node) -> None:
+        kind = scope_kind(node)
+        return_index = first_return(node.body)
+        body = node.body[: return_index + 1]
+        if kind:
+            self.emit(ENTER_SCOPE, kind)
+
+        if return_index < len(node.body):
+            # A return ends the loop after its first pass
+            self.node(node.condition)
+            to_skip = self.emit(JUMP_IF_FALSE)
+            self.block(body)
+            to_end = self.emit(JUMP)
+            self.patch(to_skip)
+            self.emit(LOAD_CONST, self.literal(None))
+            self.patch(to_end)
+        else:
+            # The iteration count sits under the loop's result on the stack
+            self.emit(LOAD_CONST, self.literal(0))
+            self.emit(LOAD_CONST, self.literal(None))
+            start = self.label()
+            self.node(node.condition)
+            to_end = self.emit(JUMP_IF_FALSE)
+            self.emit(POP_TOP)
+            self.block(body)
+            self.emit(LOOP_TICK)
+            self.emit(JUMP, start)
+            self.patch(to_end)
+            self.emit(LOOP_EXIT)
+
+        if kind:
+            self.emit(LEAVE_SCOPE, kind)
+
+    # Node type -> compiler, built once after every compiler is defined
+    _COMPILERS = {
+        NumberNode: _constant,
+        FloatNumberNode: _constant,
+        BoolNode: _constant,
+        CharNode: _char,
+        StringNode: _constant,
+        IdentifierNode: _identifier,
+        LocalRefNode: _local_ref,
+        ArrayNode: _array,
+        ArrayAccessNode: _array_access,
+        ArrayAssignmentNode: _array_assignment,
+        UnaryOpNode: _unary_op,
+        BinaryOpNode: _binary_op,
+        TypedBinaryOpNode: _typed_binary_op,
+        FunctionCallNode: _function_call,
+        FunctionDeclarationNode: _function_declaration,
+        ReturnNode: _return,
+        VariableDeclarationNode: _var_declaration,
+        VariableAssignmentNode: _var_assignment,
+        IfNode: _if,
+        WhileNode: _while,
+    }
+
+
+def scope_kind(node) -> int:
+    """How a block gets its scope, mirroring Runtime._block_scope_hooks."""
+    if not node._introduces_scope:
+        return 0
+    if node._captures_scope:
+        return FRESH_SCOPE
+    return POOLED_SCOPE
@@ -0,0 +1,327 @@
+from itertools import count
+
+from lexer import TokenType
+from parser import *
+from optimizer import walk
+
+# numba is optional: without it loop kernels run as plain Python and
+# functions are never lowered
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# Kernel status codes
+DONE = 0
+BAIL = 1
+LIMIT = 2
+
+# Loop entries before a kernel is handed to numba
+JIT_THRESHOLD = 64
+
+# Bound on every value in a compiled kernel, so that the product of any two
+# still fits in an int64
+SAFE_INT = 1 << 31
+
+# Operators a kernel can run on ints without side effects
+kernel_ops = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.MULTIPLY: "*",
+    TokenType.MODULO: "%",
+    TokenType.BIT_OR: "|",
+    TokenType.BIT_XOR: "^",
+    TokenType.BIT_AND: "&",
+}
+
+kernel_unary_ops = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.BIT_NOT: "~",
+}
+
+condition_ops = {
+    TokenType.EQUAL_EQUAL: "==",
+    TokenType.BANG_EQUAL: "!=",
+    TokenType.LESS: "<",
+    TokenType.GREATER: ">",
+    TokenType.LESS_EQUAL: "<=",
+    TokenType.GREATER_EQUAL: ">=",
+}
+
+
+def is_pure_int(node):
+    node_type = type(node)
+    if node_type is NumberNode:
+        return type(node.value) is int and -SAFE_INT <= node.value <= SAFE_INT
+    if node_type is IdentifierNode or node_type is LocalRefNode:
+        return True
+    if node_type is UnaryOpNode:
+        return node.op in kernel_unary_ops and is_pure_int(node.expr)
+    if node_type is BinaryOpNode or node_type is TypedBinaryOpNode:
+        return (
+            node.op in kernel_ops
+            and is_pure_int(node.left)
+            and is_pure_int(node.right)
+        )
+    return False
+
+
+def is_pure_condition(node):
+    if isinstance(node, BinaryOpNode) and node.op in condition_ops:
+        return is_pure_int(node.left) and is_pure_int(node.right)
+    return is_pure_int(node)
+
+
+def fits_kernel(values):
+    """Whether a compiled kernel can take these ints, as numba passes int64s."""
+    for value in values:
+        if value > SAFE_INT or value < -SAFE_INT:
+            return False
+    return True
+
+
+def reads(node):
+    return [child for child in walk(node) if isinstance(child, IdentifierNode)]
+
+
+class LoopKernel:
+    """
+    A while loop lowered to a Python function over its variables.
+
+    Only loops whose condition and body use the operators above, and whose
+    body only declares variables, are lowered: given int inputs such a loop
+    computes only ints and has no effect besides its result, so it can run
+    on plain locals and be rerun by the interpreter whenever the kernel
+    bails out. Calling the kernel with the values of `inputs` (which the
+    caller checks are ints) returns (status, ran, last).
+    """
+
+    __slots__ = ("inputs", "function", "entries", "compiled", "_locals", "_node")
+
+    def __init__(self, node):
+        self._node = node
+        self._locals = {}
+        self.inputs = []
+
+        # Names read before the loop declares them come from the scope
+        declared = set()
+        expressions = [(node.condition, None)]
+        expressions += [(statement.value, statement.name) for statement in node.body]
+        for expression, name in expressions:
+            for identifier in reads(expression):
+                if identifier.name in declared or identifier.name in self._locals:
+                    continue
+                self._locals[identifier.name] = f"v{len(self._locals)}"
+                self.inputs.append(identifier)
+            if name is not None:
+                declared.add(name)
+
+        self.function = self._build(guarded=False)
+        self.entries = 0
+        self.compiled = False
+
+    @staticmethod
+    def lower(node):
+        """A kernel for a while loop, or None if the loop can't be lowered."""
+        if not node.body or not is_pure_condition(node.condition):
+            return None
+        for statement in node.body:
+            if type(statement) is not VariableDeclarationNode:
+                return None
+            if not is_pure_int(statement.value):
+                return None
+        return LoopKernel(node)
+
+    def __call__(self, values):
+        self.entries += 1
+        if self.entries == JIT_THRESHOLD and njit is not None:
+            self._compile(values)
+        if self.compiled and not fits_kernel(values):
+            # numba can't even pass these in, let the interpreter run them
+            return BAIL, 0, 0
+        return self.function(*values)
+
+    def _compile(self, values):
+        # numba compiles on the first call; a kernel it can't type keeps
+        # running as plain Python
+        compiled = njit(self._build(guarded=True))
+        try:
+            compiled(*values)
+        except Exception:
+            return
+        self.function = compiled
+        self.compiled = True
+
+    def _build(self, guarded):
+        names = dict(self._locals)
+        for statement in self._node.body:
+            names.setdefault(statement.name, f"v{len(names)}")
+
+        source = KernelSource(names, guarded, results=2)
+        inputs = [names[identifier.name] for identifier in self.inputs]
+        source.emit(f"def kernel({', '.join(inputs)}):", 0)
+        for local in names.values():
+            if local not in inputs:
+                source.emit(f"{local} = 0", 1)
+        for local in inputs:
+            source.check(local, 1)
+        source.emit("ran = 0", 1)
+        source.emit("iteration = 0", 1)
+        source.emit("while True:", 1)
+        source.emit(f"if not {source.expression(self._node.condition, 2)}:", 2)
+        source.emit("break", 3)
+        source.emit("ran = 1", 2)
+        for statement in self._node.body:
+            value = source.expression(statement.value, 2)
+            source.emit(f"{names[statement.name]} = {value}", 2)
+        source.emit("iteration += 1", 2)
+        source.emit("if iteration > 1000:", 2)
+        source.emit(f"return {LIMIT}, 0, 0", 3)
+        last = names[self._node.body[-1].name]
+        source.emit(f"return {DONE}, ran, {last}", 1)
+        return source.function()
+
+
+class FunctionKernel:
+    """
+    A function body lowered to a numba-compiled function of its arguments.
+
+    Only resolved bodies that declare slotted locals from the operators
+    above, and at most end in a return, are lowered: given int arguments
+    such a body computes only ints and has no effect besides its result.
+    The interpreted body runs until the declaration has been called
+    JIT_THRESHOLD times, and whenever the compiled kernel bails out.
+    Calling the kernel with the argument values (which the caller checks
+    are ints) returns (status, result).
+    """
+
+    __slots__ = ("function", "calls", "_node", "_statements")
+
+    def __init__(self, node, statements):
+        self._node = node
+        self._statements = statements
+        self.function = None
+        self.calls = 0
+
+    @staticmethod
+    def lower(node, statements):
+        """A kernel for a function body, or None if it can't be lowered."""
+        if njit is None or node.local_count is None or not statements:
+            return None
+        argc = len(node.arguments)
+        if node.param_slots != list(range(argc)):
+            return None
+
+        # Every local read must be an argument or an earlier declaration
+        known = {arg.name for arg in node.arguments}
+        for statement in statements:
+            if type(statement) is ReturnNode:
+                if statement is not statements[-1]:
+                    return None
+            elif type(statement) is not VariableDeclarationNode:
+                return None
+            elif statement.slot is None:
+                return None
+            if not is_pure_int(statement.value):
+                return None
+            for child in walk(statement.value):
+                if type(child) is IdentifierNode:
+                    return None
+                if type(child) is LocalRefNode and child.name not in known:
+                    return None
+            if type(statement) is VariableDeclarationNode:
+                known.add(statement.name)
+        return FunctionKernel(node, statements)
+
+    def __call__(self, values):
+        self.calls += 1
+        if self.calls == JIT_THRESHOLD:
+            self._compile(values)
+        if self.function is None or not fits_kernel(values):
+            return BAIL, 0
+        return self.function(*values)
+
+    def _compile(self, values):
+        compiled = njit(self._build())
+        try:
+            compiled(*values)
+        except Exception:
+            return
+        self.function = compiled
+
+    def _build(self):
+        names = {}
+        for arg in self._node.arguments:
+            names.setdefault(arg.name, f"v{len(names)}")
+        for statement in self._statements:
+            if type(statement) is VariableDeclarationNode:
+                names.setdefault(statement.name, f"v{len(names)}")
+
+        source = KernelSource(names, guarded=True, results=1)
+        inputs = list(names.values())[: len(self._node.arguments)]
+        source.emit(f"def kernel({', '.join(inputs)}):", 0)
+        for local in inputs:
+            source.check(local, 1)
+        result = "0"
+        for statement in self._statements:
+            result = source.expression(statement.value, 1)
+            if type(statement) is VariableDeclarationNode:
+                source.emit(f"{names[statement.name]} = {result}", 1)
+        source.emit(f"return {DONE}, {result}", 1)
+        return source.function()
+
+
+class KernelSource:
+    """The Python source of a kernel over int locals, built line by line."""
+
+    def __init__(self, names, guarded, results):
+        self.names = names
+        # Compiled kernels run on int64s, so they bail out before overflowing
+        self.guarded = guarded
+        # Every return has the same shape, as numba needs one return type
+        self.bail = f"return {BAIL}" + ", 0" * results
+        self.lines = []
+        self.temps = count()
+
+    def emit(self, line, depth):
+        self.lines.append("    " * depth + line)
+
+    def check(self, value, depth):
+        if self.guarded:
+            self.emit(f"if {value} > {SAFE_INT} or {value} < -{SAFE_INT}:", depth)
+            self.emit(self.bail, depth + 1)
+
+    def expression(self, node, depth):
+        node_type = type(node)
+        if node_type is NumberNode:
+            return repr(node.value)
+        if node_type is IdentifierNode or node_type is LocalRefNode:
+            return self.names[node.name]
+
+        temp = f"t{next(self.temps)}"
+        if node_type is UnaryOpNode:
+            operand = self.expression(node.expr, depth)
+            self.emit(f"{temp} = {kernel_unary_ops[node.op]}{operand}", depth)
+        else:
+            left = self.expression(node.left, depth)
+            right = self.expression(node.right, depth)
+            divisor = node.right
+            if node.op == TokenType.MODULO and not (
+                type(divisor) is NumberNode and divisor.value != 0
+            ):
+                # Let the interpreter report the division by zero
+                self.emit(f"if {right} == 0:", depth)
+                self.emit(self.bail, depth + 1)
+            op = kernel_ops.get(node.op) or condition_ops[node.op]
+            self.emit(f"{temp} = {left} {op} {right}", depth)
+            if node.op in condition_ops:
+                return temp
+        self.check(temp, depth)
+        return temp
+
+    def function(self):
+        namespace = {}
+        exec("\n".join(self.lines), namespace)
+        return namespace["kernel"]
@@ -1,7 +1,7 @@
-from enum import Enum, auto
+from enum import IntEnum, auto
 
 
-class TokenType(Enum):
+class TokenType(IntEnum):
     NUMBER = auto()
     FLOAT = auto()
     BOOL = auto()
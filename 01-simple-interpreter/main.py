@@ -2,14 +2,21 @@
 import sys
 import lexer
 import parser
+import optimizer
+import resolver
 import runtime
 import pprint
 
 
-def eval_input(src, global_scope):
+def compile_source(src, scope):
+    """Compile a program to run in `scope`, whose names are already bound."""
     tokens = lexer.tokenize(src)
-    ast_tree = parser.parse(tokens)
-    r = runtime.Runtime(global_scope)
+    statements = optimizer.optimize(parser.parse(tokens), scope.symbols)
+    return resolver.resolve(statements)
+
+
+def eval_input(src, r):
+    ast_tree = compile_source(src, r.scope)
 
     try:
         result = r.execute(ast_tree)
@@ -30,20 +37,20 @@ def handle_multiline_input():
             return multiline_buffer
 
 
-def main(file_path=None, src=None):
+def main(file_path=None, src=None, vm=False):
     if file_path and src:
-        tokens = lexer.tokenize(src)
-        ast_tree = parser.parse(tokens)
-        global_scope = runtime.Scope()
-        r = runtime.Runtime(global_scope)
+        global_scope = runtime.GlobalScope()
+        ast_tree = compile_source(src, global_scope)
+        r = runtime.Runtime(global_scope, vm)
         try:
             result = r.execute(ast_tree)
-            exit(result)
         except runtime.RuntimeError as e:
             print(f"{e}")
-            return None
+            sys.exit(1)
+        exit(result)
     else:
-        global_scope = runtime.Scope()
+        # One runtime for the whole session, every input runs in its scope
+        r = runtime.Runtime(runtime.GlobalScope(), vm)
         print("Welcome to the REPL. Type 'exit' to quit.")
 
         while True:
@@ -56,7 +63,7 @@ def main(file_path=None, src=None):
                 if "{" in src:
                     src += handle_multiline_input()
 
-                result = eval_input(src, global_scope)
+                result = eval_input(src, r)
 
                 if result is not None:
                     print(result)
@@ -67,13 +74,31 @@ def main(file_path=None, src=None):
                 print(f"Error: {e}")
 
 
+def check_pypy():
+    if sys.implementation.name != "pypy":
+        print(
+            f"Note: running on {sys.implementation.name}. The interpreter is"
+            " considerably faster under PyPy, try: pypy3 main.py <file>",
+            file=sys.stderr,
+        )
+
+
 def bootstrap():
+    if "--pypy-check" in sys.argv:
+        sys.argv.remove("--pypy-check")
+        check_pypy()
+
+    # Run on the stack machine, which allows deep recursion
+    vm = "--vm" in sys.argv
+    if vm:
+        sys.argv.remove("--vm")
+
     if len(sys.argv) == 2:
         file_path = sys.argv[1]
         try:
             with open(file_path, "r") as file:
                 content = file.read()
-                main(file_path, content)
+                main(file_path, content, vm)
         except FileNotFoundError:
             print(f"Error: File '{file_path}' not found.")
             sys.exit(1)
@@ -81,7 +106,7 @@ def bootstrap():
             print(f"Error reading file: {e}")
             sys.exit(1)
     else:
-        main()
+        main(vm=vm)
 
 
 if __name__ == "__main__":
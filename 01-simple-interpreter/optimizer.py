@@ -0,0 +1,242 @@
+from lexer import TokenType
+from parser import *
+from compiler import binary_operators, unary_operators
+
+
+# Operators that always produce an int from two int operands
+int_result_ops = {
+    TokenType.PLUS,
+    TokenType.MINUS,
+    TokenType.MULTIPLY,
+    TokenType.MODULO,
+    TokenType.BIT_OR,
+    TokenType.BIT_XOR,
+    TokenType.BIT_AND,
+    TokenType.BIT_LSH,
+    TokenType.BIT_RSH,
+}
+
+# Operators that can run on the typed fast path when both operands are ints
+typed_ops = int_result_ops | {
+    TokenType.DIVIDE,
+    TokenType.EQUAL_EQUAL,
+    TokenType.BANG_EQUAL,
+    TokenType.LESS,
+    TokenType.GREATER,
+    TokenType.LESS_EQUAL,
+    TokenType.GREATER_EQUAL,
+}
+
+compound_ops = (TokenType.PLUS_EQUAL, TokenType.MINUS_EQUAL)
+
+number_nodes = (NumberNode, FloatNumberNode)
+
+# Ints that would grow past this many bits are left for the runtime to build
+max_folded_bits = 64
+
+
+def children(node):
+    """Yield the direct child nodes of an AST node."""
+    for _, value in node.fields():
+        if isinstance(value, ASTNode):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, ASTNode):
+                    yield item
+
+
+def walk(node):
+    yield node
+    for child in children(node):
+        yield from walk(child)
+
+
+def transform(node, fn):
+    """Rebuild `node` bottom-up, replacing every node with `fn(node)`."""
+    for key, value in node.fields():
+        if isinstance(value, ASTNode):
+            setattr(node, key, transform(value, fn))
+        elif isinstance(value, list):
+            value[:] = [
+                transform(item, fn) if isinstance(item, ASTNode) else item
+                for item in value
+            ]
+    return fn(node)
+
+
+def is_int(node, int_names):
+    if isinstance(node, NumberNode):
+        return True
+    if isinstance(node, IdentifierNode):
+        return node.name in int_names
+    if isinstance(node, UnaryOpNode):
+        return is_int(node.expr, int_names)
+    if isinstance(node, BinaryOpNode):
+        return (
+            node.op in int_result_ops
+            and is_int(node.left, int_names)
+            and is_int(node.right, int_names)
+        )
+    return False
+
+
+def infer_int_names(statements, predefined=()):
+    """
+    Find the variables that only ever hold ints.
+
+    Names are merged across scopes, so a variable is only treated as an
+    int if every declaration and assignment to that name in the program
+    stores an int. Names in `predefined` are bound before the program runs
+    (builtins and earlier REPL input) and may hold anything.
+    """
+    bindings = []
+    candidates = set()
+    excluded = {"self", *predefined}
+
+    for node in (n for stmt in statements for n in walk(stmt)):
+        if isinstance(node, VariableDeclarationNode):
+            candidates.add(node.name)
+            bindings.append((node.name, node.value))
+        elif isinstance(node, VariableAssignmentNode):
+            bindings.append((node.name, node.value))
+        elif (
+            isinstance(node, BinaryOpNode)
+            and node.op in compound_ops
+            and isinstance(node.left, IdentifierNode)
+        ):
+            bindings.append((node.left.name, node.right))
+        elif isinstance(node, FunctionDeclarationNode):
+            excluded.add(node.name)
+            excluded.update(arg.name for arg in node.arguments)
+
+    int_names = candidates - excluded
+    changed = True
+    while changed:
+        changed = False
+        for name, value in bindings:
+            if name in int_names and not is_int(value, int_names):
+                int_names.discard(name)
+                changed = True
+
+    return int_names
+
+
+def number_literal(value):
+    """A literal node holding a folded value, or None if it has no literal form."""
+    if type(value) is int:
+        return NumberNode(value)
+    if type(value) is float:
+        return FloatNumberNode(value)
+    return None
+
+
+def too_large(op, left, right):
+    """Whether `left op right` could build an int past max_folded_bits."""
+    if type(left) is not int or type(right) is not int:
+        return False
+    if op == TokenType.MULTIPLY:
+        return left.bit_length() + right.bit_length() > max_folded_bits
+    if op == TokenType.BIT_LSH:
+        return left != 0 and right > max_folded_bits - left.bit_length()
+    # The other operators grow their result by a bit at most
+    return False
+
+
+def fold(node):
+    """Evaluate an operator whose operands are number or string literals."""
+    try:
+        if type(node) is UnaryOpNode and type(node.expr) in number_nodes:
+            operation = unary_operators[node.op]
+            if operation is not None:
+                return number_literal(operation(node.expr.value)) or node
+        if (
+            type(node) is BinaryOpNode
+            and type(node.left) in number_nodes
+            and type(node.right) in number_nodes
+        ):
+            operation = binary_operators[node.op]
+            left, right = node.left.value, node.right.value
+            if operation is not None and not too_large(node.op, left, right):
+                value = operation(left, right)
+                return number_literal(value) or node
+        if (
+            type(node) is BinaryOpNode
+            and node.op == TokenType.PLUS
+            and type(node.left) is StringNode
+            and type(node.right) is StringNode
+        ):
+            # Only concatenation, whose result is no larger than its operands
+            return StringNode(node.left.value + node.right.value)
+    except (ArithmeticError, TypeError, ValueError):
+        # Left in place so the runtime reports the error when it is reached
+        pass
+    return node
+
+
+def prune(statements):
+    """
+    Resolve the ifs and whiles of a block whose condition is a literal.
+
+    Conditions are tested for truthiness like at runtime, where the raw text
+    of a bool literal is always true. A taken branch that declares nothing
+    and holds no return runs the same in the enclosing block, so it is
+    spliced in. A statement left with nothing to run only produces None, so
+    it is dropped unless it is the last statement, whose value is the
+    block's result.
+    """
+    pruned = []
+    last = len(statements) - 1
+    for index, statement in enumerate(statements):
+        node_type = type(statement)
+        if (node_type is IfNode or node_type is WhileNode) and type(
+            statement.condition
+        ) in literal_nodes:
+            taken = bool(statement.condition.value)
+            if node_type is IfNode:
+                branch = statement.body if taken else statement.else_body
+            else:
+                # A loop that runs is left to the iteration limit
+                branch = statement.body if taken else None
+            if not branch:
+                if index != last:
+                    continue
+            elif node_type is IfNode and not declares_names(branch):
+                if first_return(branch) == len(branch):
+                    pruned.extend(branch)
+                    continue
+        pruned.append(statement)
+    return pruned
+
+
+def optimize(statements, predefined=()):
+    """Run the compile-time passes over a parsed program."""
+    int_names = infer_int_names(statements, predefined)
+
+    def specialize(node):
+        node = fold(node)
+        if type(node) is CharNode:
+            # Chars are one-character strings at runtime, so fold the chr()
+            return StringNode(chr(node.value))
+        if (
+            type(node) is BinaryOpNode
+            and node.op in typed_ops
+            and is_int(node.left, int_names)
+            and is_int(node.right, int_names)
+        ):
+            return TypedBinaryOpNode(node.left, node.op, node.right)
+        if type(node) is ArrayNode:
+            # Re-derive the element annotations from the rewritten elements
+            return ArrayNode(node.elements)
+        return node
+
+    statements = [transform(stmt, specialize) for stmt in statements]
+
+    # Innermost blocks first, so spliced branches are already pruned
+    nodes = [node for stmt in statements for node in walk(stmt)]
+    for node in reversed(nodes):
+        if type(node) in (IfNode, WhileNode, FunctionDeclarationNode):
+            node.body[:] = prune(node.body)
+        if type(node) is IfNode and node.else_body is not None:
+            node.else_body[:] = prune(node.else_body)
+    return prune(statements)
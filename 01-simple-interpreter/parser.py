@@ -3,94 +3,170 @@ from lexer import TokenType
 
 # AST Nodes
 class ASTNode:
+    __slots__ = ()
+
+    def fields(self):
+        """(name, value) pairs for every attribute set on the node."""
+        return [
+            (name, getattr(self, name))
+            for cls in reversed(type(self).__mro__)
+            for name in cls.__dict__.get("__slots__", ())
+            if hasattr(self, name)
+        ]
+
     def __repr__(self):
-        return f"{self.__class__.__name__}({', '.join(f'{k}={v!r}' for k, v in self.__dict__.items())})"
+        return f"{self.__class__.__name__}({', '.join(f'{k}={v!r}' for k, v in self.fields() if not k.startswith('_'))})"
 
 
 class NumberNode(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
 
 class FloatNumberNode(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
 
 class BoolNode(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
 
 class CharNode(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = ord(value)
 
 
 class StringNode(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = str(value)
 
 
 class UnaryOpNode(ASTNode):
+    __slots__ = ("op", "expr")
+
     def __init__(self, op_token, expr):
         self.op = op_token
         self.expr = expr
 
 
 class BinaryOpNode(ASTNode):
+    __slots__ = ("left", "op", "right")
+
     def __init__(self, left, op_token, right):
         self.left = left
         self.op = op_token
         self.right = right
 
 
+class TypedBinaryOpNode(BinaryOpNode):
+    __slots__ = ("checks_zero",)
+
+    def __init__(self, left, op_token, right):
+        super().__init__(left, op_token, right)
+        self.checks_zero = op_token in (TokenType.DIVIDE, TokenType.MODULO)
+
+
 class FunctionCallNode(ASTNode):
+    __slots__ = ("name", "arguments", "slot", "cache")
+
     def __init__(self, name, arguments):
         self.name = name
         self.arguments = arguments
+        self.slot = None
+        # (bindings version, scope, callee) of the last lookup at this site
+        self.cache = (-1, None, None)
 
 
 class IdentifierNode(ASTNode):
+    __slots__ = ("name", "slot")
+
     def __init__(self, name):
         self.name = name
+        self.slot = None
+
+
+class LocalRefNode(IdentifierNode):
+    """A read of a function local that the resolver placed in a frame slot."""
+
+    __slots__ = ()
+
+    def __init__(self, name, slot):
+        self.name = name
+        self.slot = slot
 
 
 class ReturnNode(ASTNode):
+    __slots__ = ("value",)
+
     def __init__(self, return_value):
         self.value = return_value
 
 
 class VariableDeclarationNode(ASTNode):
+    __slots__ = ("name", "value", "slot")
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        self.slot = None
 
 
 class VariableAccessNode(ASTNode):
+    __slots__ = ("variable", "index")
+
     def __init__(self, variable, index):
         self.variable = variable
         self.index = index
 
 
 class VariableAssignmentNode(ASTNode):
+    __slots__ = ("name", "value", "slot")
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
+        self.slot = None
 
 
 class ArrayNode(ASTNode):
+    __slots__ = ("elements", "_precomputed_list")
+
     def __init__(self, elements):
         self.elements = elements
 
+        # Arrays of plain literals are built once and copied on evaluation
+        self._precomputed_list = None
+        if all(isinstance(element, literal_nodes) for element in elements):
+            self._precomputed_list = [element.value for element in elements]
+
+
+# Literal nodes that evaluate to their stored value
+literal_nodes = (NumberNode, FloatNumberNode, BoolNode, StringNode)
+
 
 class ArrayAccessNode(ASTNode):
+    __slots__ = ("array", "index")
+
     def __init__(self, array, index):
         self.array = array
         self.index = index
 
 
 class ArrayAssignmentNode(ASTNode):
+    __slots__ = ("array", "index", "value")
+
     def __init__(self, array, index, value):
         self.array = array
         self.index = index
@@ -98,23 +174,66 @@ class ArrayAssignmentNode(ASTNode):
 
 
 class FunctionDeclarationNode(ASTNode):
+    __slots__ = ("name", "arguments", "body", "local_count", "param_slots", "self_slot")
+
     def __init__(self, name, arguments, body):
         self.name = name
         self.arguments = arguments
         self.body = body
+        # Filled in by the resolver when the locals can live in slots
+        self.local_count = None
+        self.param_slots = None
+        self.self_slot = None
 
 
 class IfNode(ASTNode):
+    __slots__ = ("condition", "body", "else_body", "_introduces_scope", "_captures_scope")
+
     def __init__(self, condition, body, else_body=None):
         self.condition = condition
         self.body = body
         self.else_body = else_body
+        self._introduces_scope = declares_names(body) or declares_names(
+            else_body or []
+        )
+        self._captures_scope = declares_functions(body) or declares_functions(
+            else_body or []
+        )
 
 
 class WhileNode(ASTNode):
+    __slots__ = ("condition", "body", "_introduces_scope", "_captures_scope")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
+        self._introduces_scope = declares_names(body)
+        self._captures_scope = declares_functions(body)
+
+
+def first_return(body):
+    """Index of the first top-level return in a block, or len(body) if none."""
+    for index, statement in enumerate(body):
+        if type(statement) is ReturnNode:
+            return index
+    return len(body)
+
+
+def declares_names(body):
+    """Whether a block defines names of its own and so needs a child scope."""
+    return any(
+        isinstance(stmt, (VariableDeclarationNode, FunctionDeclarationNode))
+        for stmt in body
+    )
+
+
+def declares_functions(body):
+    """Whether a function declared somewhere in a block can capture its scope."""
+    return any(
+        isinstance(stmt, FunctionDeclarationNode)
+        or (isinstance(stmt, (IfNode, WhileNode)) and stmt._captures_scope)
+        for stmt in body
+    )
 
 
 # (type, precedence)
@@ -0,0 +1,143 @@
+from parser import *
+from optimizer import transform, walk
+
+
+# Nodes that read or bind a variable by name
+named_nodes = (
+    IdentifierNode,
+    FunctionCallNode,
+    VariableAssignmentNode,
+    VariableDeclarationNode,
+)
+
+
+def used_names(node):
+    """Yield every name a node reads or writes, without following declarations."""
+    for child in walk(node):
+        if isinstance(
+            child, (IdentifierNode, FunctionCallNode, VariableAssignmentNode)
+        ):
+            yield child.name
+
+
+def nested_blocks(body_nodes):
+    """Yield (statements, node) for every block of the ifs and whiles given."""
+    for child in body_nodes:
+        if isinstance(child, (IfNode, WhileNode)):
+            yield child.body, child
+        if isinstance(child, IfNode) and child.else_body is not None:
+            yield child.else_body, child
+
+
+def block_locals(body_nodes, declared):
+    """
+    Find the names that can live in a slot although a nested block declares them.
+
+    Such a name is declared in exactly one block and in no outer one, and
+    every use of it follows its first declaration in that block. Every
+    lookup would find the block's binding then, so the block needs no
+    dict entry for it. A use in a while condition or in the declared value
+    itself counts as coming before the declaration.
+    """
+    uses = {}
+    for child in body_nodes:
+        if isinstance(child, named_nodes):
+            uses[child.name] = uses.get(child.name, 0) + 1
+
+    owners = {}
+    for statements, _ in nested_blocks(body_nodes):
+        for index, stmt in enumerate(statements):
+            if isinstance(stmt, VariableDeclarationNode):
+                owner = owners.setdefault(stmt.name, (statements, index))
+                if owner is not None and owner[0] is not statements:
+                    owners[stmt.name] = None
+
+    names = []
+    for name, owner in owners.items():
+        if owner is None or name in declared:
+            continue
+        statements, index = owner
+        scoped = [statements[index]]
+        scoped += [child for stmt in statements[index + 1 :] for child in walk(stmt)]
+        scoped_uses = sum(
+            isinstance(child, named_nodes) and child.name == name for child in scoped
+        )
+        if scoped_uses == uses[name]:
+            names.append(name)
+    return names
+
+
+def resolve_function(node):
+    """
+    Give a function's locals fixed slot indices where that is safe.
+
+    Parameters, `self` and the variables declared at the top level of the
+    body become slots in a per-call list, unless the name is also declared
+    inside a nested block (which shadows it) or is used before its first
+    declaration (where the lookup would find an outer variable). Names
+    declared in a nested block get a slot when only that block uses them,
+    and a block left with no dict-bound declarations runs without a scope
+    of its own. Functions that declare other functions keep every local in
+    the scope dict, since the inner functions look their names up through
+    it.
+    """
+    body_nodes = [child for stmt in node.body for child in walk(stmt)]
+    if any(isinstance(child, FunctionDeclarationNode) for child in body_nodes):
+        return
+
+    params = [arg.name for arg in node.arguments]
+    declared = set(params) | {"self"}
+    dynamic = set()
+    top_level_vars = []
+
+    for stmt in node.body:
+        for child in walk(stmt):
+            if isinstance(child, VariableDeclarationNode) and child is not stmt:
+                dynamic.add(child.name)
+        dynamic.update(name for name in used_names(stmt) if name not in declared)
+        if isinstance(stmt, VariableDeclarationNode):
+            declared.add(stmt.name)
+            top_level_vars.append(stmt.name)
+
+    slots = {}
+    for name in params + ["self"] + top_level_vars:
+        if name not in dynamic and name not in slots:
+            slots[name] = len(slots)
+    for name in block_locals(body_nodes, declared):
+        slots[name] = len(slots)
+
+    node.local_count = len(slots)
+    node.param_slots = [slots.get(name) for name in params]
+    node.self_slot = slots.get("self")
+
+    for child in body_nodes:
+        if isinstance(
+            child, (FunctionCallNode, VariableDeclarationNode, VariableAssignmentNode)
+        ):
+            child.slot = slots.get(child.name)
+
+    # Blocks whose declarations all live in slots share the frame
+    for child in body_nodes:
+        if isinstance(child, (IfNode, WhileNode)):
+            child._introduces_scope = False
+    for statements, block in nested_blocks(body_nodes):
+        if any(
+            isinstance(stmt, VariableDeclarationNode) and stmt.slot is None
+            for stmt in statements
+        ):
+            block._introduces_scope = True
+
+    def localize(child):
+        if type(child) is IdentifierNode and child.name in slots:
+            return LocalRefNode(child.name, slots[child.name])
+        return child
+
+    node.body = [transform(stmt, localize) for stmt in node.body]
+
+
+def resolve(statements):
+    """Resolve function locals to slots across a whole program."""
+    for node in (child for stmt in statements for child in walk(stmt)):
+        if isinstance(node, FunctionDeclarationNode):
+            resolve_function(node)
+    return statements
@@ -1,10 +1,25 @@
-import math
 from parser import *
 from lexer import *
+from jit import DONE, LIMIT, FunctionKernel, LoopKernel
+from codegen import BodyGenerator
+from compiler import *
 from typing import Dict, List, Any, Callable, Optional, Union
-from functools import lru_cache
-import random
-import sys
+from random import _inst as _random
+from sys import intern, maxsize as _MAXSIZE, stdout
+
+_PI = 3.141592653589793
+
+# Pre-bound callables for the hot built-ins
+_RANDBELOW = _random._randbelow
+_INT = int
+_FLOAT = float
+_LEN = len
+
+# Marks a missing entry in single-probe dict lookups
+_MISSING = object()
+
+# Names looked up by call sites that cache their callee
+_CALLED_NAMES = set()
 
 
 class RuntimeError(Exception):
@@ -18,131 +33,187 @@ class RuntimeError(Exception):
     def __str__(self) -> str:
         location = f" in scope at {hex(id(self.scope))}"
         if self.func:
-            return f"\033[91mRuntimeError{location} in function '{self.func.name}': {self.message}\033[0m"
-        return f"\033[91mRuntimeError{location}: {self.message}\033[0m"
+            text = f"RuntimeError{location} in function '{self.func.name}': {self.message}"
+        else:
+            text = f"RuntimeError{location}: {self.message}"
+        # Errors are printed to stdout, so only color them on a terminal
+        if stdout.isatty():
+            return f"\033[91m{text}\033[0m"
+        return text
 
 
 class Function:
+    __slots__ = ("name", "_repr")
+
     def __init__(self, name: str):
         self.name = name
+        # Built on the first __repr__, the function never changes afterwards
+        self._repr = None
 
     def __call__(self, args: List[Any]) -> Any:
         raise NotImplementedError("Function subclasses must implement __call__")
 
-    def validate_args(
-        self, args: List[Any], expected_count: Optional[int] = None
-    ) -> None:
-        if expected_count is not None and len(args) != expected_count:
-            raise RuntimeError(f"Expected {expected_count} arguments, got {len(args)}")
-
     def __repr__(self) -> str:
-        return f"<Function '{self.name}' at {hex(id(self))}>"
+        if self._repr is None:
+            self._repr = f"<Function '{self.name}' at {hex(id(self))}>"
+        return self._repr
 
 
 class BuiltInFunction(Function):
+    __slots__ = ("implementation", "expected_args", "call_one")
+
     def __init__(
-        self, name: str, implementation: Callable, expected_args: Optional[int] = None
+        self,
+        name: str,
+        implementation: Callable,
+        expected_args: Optional[int] = None,
+        call_one: Optional[Callable] = None,
     ):
         super().__init__(name)
         self.implementation = implementation
         self.expected_args = expected_args
+        # Takes the single argument directly, for one-argument call sites
+        self.call_one = call_one
 
     def __call__(self, args: List[Any]) -> Any:
-        try:
-            if self.expected_args is not None:
-                self.validate_args(args, self.expected_args)
-            return self.implementation(args)
-        except RuntimeError:
-            raise
-        except Exception as e:
-            raise RuntimeError(f"Error in built-in function '{self.name}': {str(e)}")
+        # Implementations raise their own RuntimeErrors, no need to wrap them
+        if self.expected_args is not None and len(args) != self.expected_args:
+            raise RuntimeError(
+                f"Expected {self.expected_args} arguments, got {len(args)}"
+            )
+        return self.implementation(args)
 
     def __repr__(self) -> str:
-        return f"<Built-in Function '{self.name}' at {hex(id(self))}>"
+        if self._repr is None:
+            self._repr = f"<Built-in Function '{self.name}' at {hex(id(self))}>"
+        return self._repr
 
 
 class UserFunction(Function):
-    __slots__ = ("name", "node", "scope")
+    __slots__ = (
+        "node",
+        "scope",
+        "_expected_argc",
+        "_arg_names",
+        "_body_plan",
+        "_frames",
+        "_params_in_order",
+        "_code",
+    )
 
     def __init__(self, name: str, node, defining_scope):
         super().__init__(name)
         self.node = node
         self.scope = defining_scope
 
-    def __call__(self, args: List[Any]) -> Any:
-        try:
-            self.validate_args(args, len(self.node.arguments))
-            func_scope = Scope(parent=self.scope)
-
-            for arg_node, value in zip(self.node.arguments, args):
-                func_scope.define(arg_node.name, value)
-
-            func_scope.define("self", self)
-
-            runtime = Runtime(func_scope)
-            result = None
+    def _prepare(self, body, code=None) -> None:
+        """Resolve everything a call needs that does not depend on the arguments."""
+        self._expected_argc = len(self.node.arguments)
+        self._arg_names = [intern(arg.name) for arg in self.node.arguments]
+        self._body_plan = body
+        # Compiled body for Runtime.run_code, when the function was made there
+        self._code = code
+        # Idle call scopes, only kept for functions with resolved slots since
+        # nothing can capture their scope once the call returns
+        self._frames = [] if self.node.local_count is not None else None
+        self._params_in_order = self.node.param_slots == list(
+            range(self._expected_argc)
+        )
 
-            for statement in self.node.body:
-                result = runtime.evaluate(statement)
-                if isinstance(statement, ReturnNode):
-                    return result if result is not None else 0
+    def _new_frame(self) -> "Scope":
+        node = self.node
+        frame = Scope(parent=self.scope)
+        frame.slots = [None] * node.local_count
+        if node.self_slot is None:
+            frame.symbols["self"] = self
+        else:
+            frame.slots[node.self_slot] = self
+        return frame
 
-            return result if result is not None else 0
-        except RuntimeError as e:
-            if e.func is None:
-                e.func = self
-            raise
-        except Exception as e:
+    def _enter_frame(self, args: List[Any]) -> "Scope":
+        """The scope a call runs in, with the arguments bound."""
+        if len(args) != self._expected_argc:
             raise RuntimeError(
-                f"Error in function '{self.name}': {str(e)}",
+                f"Expected {self._expected_argc} arguments, got {len(args)}",
                 func=self,
-                scope=self.scope,
             )
 
+        frames = self._frames
+        if frames is None:
+            func_scope = Scope(parent=self.scope)
+            symbols = func_scope.symbols
+            for name, value in zip(self._arg_names, args):
+                symbols[name] = value
+            symbols["self"] = self
+            return func_scope
+
+        # Every slot is written before it is read, so a reused frame only
+        # needs its arguments filled in
+        frame = frames.pop() if frames else self._new_frame()
+        slots = frame.slots
+        if self._params_in_order:
+            slots[: self._expected_argc] = args
+        else:
+            for name, slot, value in zip(self._arg_names, self.node.param_slots, args):
+                if slot is None:
+                    frame.define(name, value)
+                else:
+                    slots[slot] = value
+        return frame
+
+    def _leave_frame(self, frame: "Scope") -> None:
+        frames = self._frames
+        if frames is not None and len(frames) < SCOPE_POOL_SIZE:
+            if frame.symbols:
+                frame.clear()
+                if self.node.self_slot is None:
+                    frame.symbols["self"] = self
+            # The next call may run under shadowing bindings this one never saw
+            frame._cached_lookups.clear()
+            frames.append(frame)
+
+    def __call__(self, args: List[Any]) -> Any:
+        # Errors are attributed to the function by Runtime.execute, so calls
+        # don't need an exception handler of their own
+        frame = self._enter_frame(args)
+        result = None
+        for statement in self._body_plan:
+            result = statement(frame)
+        self._leave_frame(frame)
+        return result if result is not None else 0
+
     def __repr__(self) -> str:
-        arg_list = ", ".join(arg.name for arg in self.node.arguments)
-        return f"<UserFunction '{self.name}'({arg_list}) at {hex(id(self))}>"
+        if self._repr is None:
+            arg_list = ", ".join(arg.name for arg in self.node.arguments)
+            self._repr = f"<UserFunction '{self.name}'({arg_list}) at {hex(id(self))}>"
+        return self._repr
 
 
 class Scope:
-    __slots__ = ("symbols", "parent", "_cached_lookups")
+    __slots__ = ("symbols", "parent", "slots", "_cached_lookups")
 
-    def __init__(self, parent=None):
+    # Bumped whenever a name in _CALLED_NAMES is bound, rebound or dropped
+    # anywhere, which invalidates every call-site cache
+    _bindings_version = 0
+
+    def __init__(self, parent: "Scope"):
         self.symbols: Dict[str, Any] = {}
         self.parent = parent
+        # Resolved function locals, shared by every block inside the call
+        self.slots = parent.slots
         self._cached_lookups = {}
 
-        if parent is None:
-            self._initialize_builtins()
-
-    def _initialize_builtins(self) -> None:
-        """Initialize built-in constants and functions in global scope."""
-        self.define("PI", math.pi)
-
-        builtin_functions = {
-            "print": BuiltInFunction("print", Runtime.Builtins.print_func, None),
-            "input": BuiltInFunction("input", Runtime.Builtins.input_func, None),
-            "str": BuiltInFunction("str", Runtime.Builtins.str_func, None),
-            "int": BuiltInFunction("int", Runtime.Builtins.int_func, 1),
-            "float": BuiltInFunction("float", Runtime.Builtins.float_func, 1),
-            "len": BuiltInFunction("len", Runtime.Builtins.len_func, 1),
-            "exit": BuiltInFunction("exit", Runtime.Builtins.exit_func, 1),
-            "rand": BuiltInFunction("rand", Runtime.Builtins.rand_func, 0),
-        }
-
-        for name, func in builtin_functions.items():
-            self.define(name, func)
-
     def lookup(self, name: str) -> Any:
-        if name in self._cached_lookups:
-            target_scope, value = self._cached_lookups[name]
-            if name in target_scope.symbols and target_scope.symbols[name] is value:
+        cached = self._cached_lookups.get(name)
+        if cached is not None:
+            target_scope, value = cached
+            if target_scope.symbols.get(name, _MISSING) is value:
                 return value
 
         scope = self
-        while scope:
-            if name in scope.symbols:
-                value = scope.symbols[name]
+        while scope is not None:
+            value = scope.symbols.get(name, _MISSING)
+            if value is not _MISSING:
                 self._cached_lookups[name] = (scope, value)
                 return value
             scope = scope.parent
@@ -151,16 +222,24 @@ class Scope:
 
     def define(self, name: str, value: Any) -> None:
         self.symbols[name] = value
-        if name in self._cached_lookups:
-            del self._cached_lookups[name]
+        self._cached_lookups.pop(name, None)
+        if name in _CALLED_NAMES:
+            Scope._bindings_version += 1
+
+    def clear(self) -> None:
+        if not _CALLED_NAMES.isdisjoint(self.symbols):
+            Scope._bindings_version += 1
+        self.symbols.clear()
 
     def assign(self, name: str, value: Any) -> None:
         scope = self
-        while scope:
-            if name in scope.symbols:
-                scope.symbols[name] = value
-                if name in self._cached_lookups:
-                    self._cached_lookups[name] = (scope, value)
+        while scope is not None:
+            symbols = scope.symbols
+            if name in symbols:
+                symbols[name] = value
+                self._cached_lookups[name] = (scope, value)
+                if name in _CALLED_NAMES:
+                    Scope._bindings_version += 1
 
                 print(f"{name} = {value}")
                 return
@@ -168,12 +247,72 @@ class Scope:
         raise RuntimeError(f"Assignment to undefined variable: {name}", scope=self)
 
 
+class GlobalScope(Scope):
+    """The root scope of a program, holding the built-in constants and functions."""
+
+    __slots__ = ()
+
+    def __init__(self):
+        # Set up directly, so Scope.__init__ needs no check for a parent
+        self.symbols: Dict[str, Any] = {}
+        self.parent = None
+        self.slots = None
+        self._cached_lookups = {}
+        self._initialize_builtins()
+
+    def _initialize_builtins(self) -> None:
+        """Initialize built-in constants and functions in global scope."""
+        self.define("PI", _PI)
+
+        builtins = Runtime.Builtins
+        builtin_functions = {
+            "print": BuiltInFunction(
+                "print", builtins.print_func, None, builtins.print_one
+            ),
+            "input": BuiltInFunction(
+                "input", builtins.input_func, None, builtins.input_one
+            ),
+            "str": BuiltInFunction("str", builtins.str_func, None, builtins.str_one),
+            "int": BuiltInFunction("int", builtins.int_func, 1, builtins.int_one),
+            "float": BuiltInFunction(
+                "float", builtins.float_func, 1, builtins.float_one
+            ),
+            "len": BuiltInFunction("len", builtins.len_func, 1, builtins.len_one),
+            "exit": BuiltInFunction("exit", builtins.exit_func, 1, builtins.exit_one),
+            "rand": BuiltInFunction("rand", builtins.rand_func, 0),
+        }
+
+        for name, func in builtin_functions.items():
+            self.define(name, func)
+
+
+# Upper bound on the number of idle scopes kept for reuse, per pool
+SCOPE_POOL_SIZE = 16
+
+# Deepest user recursion Runtime.run_code allows before giving up, as the
+# closures do when they run out of Python stack
+MAX_CALL_DEPTH = 100000
+
+
 class Runtime:
+    _scope_pool: List[Scope] = []
+
     class Builtins:
+        # Each builtin taking one argument also has a `*_one` entry point
+        # that call sites with a single argument use without building a list
+
         @staticmethod
         def print_func(args: List[Any]) -> None:
             try:
-                print("".join(str(arg) for arg in args))
+                print(join_args(args))
+                return None
+            except Exception as e:
+                raise RuntimeError(f"Print error: {str(e)}")
+
+        @staticmethod
+        def print_one(value: Any) -> None:
+            try:
+                print(value)
                 return None
             except Exception as e:
                 raise RuntimeError(f"Print error: {str(e)}")
@@ -181,279 +320,301 @@ class Runtime:
         @staticmethod
         def input_func(args: List[Any]) -> str:
             try:
-                return input("".join(str(arg) for arg in args))
+                return input(join_args(args))
+            except Exception as e:
+                raise RuntimeError(f"Input error: {str(e)}")
+
+        @staticmethod
+        def input_one(value: Any) -> str:
+            try:
+                return input(str(value))
             except Exception as e:
                 raise RuntimeError(f"Input error: {str(e)}")
 
         @staticmethod
         def str_func(args: List[Any]) -> str:
             try:
-                return "".join(str(arg) for arg in args)
+                return join_args(args)
+            except Exception as e:
+                raise RuntimeError(f"String conversion error: {str(e)}")
+
+        @staticmethod
+        def str_one(value: Any) -> str:
+            try:
+                return str(value)
             except Exception as e:
                 raise RuntimeError(f"String conversion error: {str(e)}")
 
         @staticmethod
         def int_func(args: List[Any]) -> int:
+            return Runtime.Builtins.int_one(args[0])
+
+        @staticmethod
+        def int_one(value: Any) -> int:
             try:
-                return int(args[0])
+                return _INT(value)
             except ValueError:
-                raise RuntimeError(f"Cannot convert {args[0]} to int")
+                raise RuntimeError(f"Cannot convert {value} to int")
             except Exception as e:
                 raise RuntimeError(f"Integer conversion error: {str(e)}")
 
         @staticmethod
         def float_func(args: List[Any]) -> float:
+            return Runtime.Builtins.float_one(args[0])
+
+        @staticmethod
+        def float_one(value: Any) -> float:
             try:
-                return float(args[0])
+                return _FLOAT(value)
             except ValueError:
-                raise RuntimeError(f"Cannot convert {args[0]} to float")
+                raise RuntimeError(f"Cannot convert {value} to float")
             except Exception as e:
                 raise RuntimeError(f"Float conversion error: {str(e)}")
 
         @staticmethod
         def len_func(args: List[Any]) -> int:
+            return Runtime.Builtins.len_one(args[0])
+
+        @staticmethod
+        def len_one(value: Any) -> int:
             try:
-                return len(args[0])
+                return _LEN(value)
             except TypeError:
                 raise RuntimeError(
-                    f"Object of type {type(args[0]).__name__} has no len()"
+                    f"Object of type {type(value).__name__} has no len()"
                 )
             except Exception as e:
                 raise RuntimeError(f"Length error: {str(e)}")
 
         @staticmethod
         def exit_func(args: List[Any]) -> None:
+            return Runtime.Builtins.exit_one(args[0])
+
+        @staticmethod
+        def exit_one(value: Any) -> None:
             try:
-                exit(args[0])
+                exit(value)
             except Exception as e:
                 raise RuntimeError(f"Exit error: {str(e)}")
 
         @staticmethod
         def rand_func(args: List[Any]) -> int:
-            try:
-                return random.randrange(0, sys.maxsize)
-            except Exception as e:
-                raise RuntimeError(f"Rand error: {str(e)}")
+            return _RANDBELOW(_MAXSIZE)
 
-    def __init__(self, scope: Scope):
+    def __init__(self, scope: Scope, vm: bool = False):
         self.scope = scope
-        self._node_handlers = {
-            NumberNode: self._eval_number,
-            FloatNumberNode: self._eval_float,
-            BoolNode: self._eval_bool,
-            CharNode: self._eval_char,
-            StringNode: self._eval_string,
-            IdentifierNode: self._eval_identifier,
-            ArrayNode: self._eval_array,
-            ArrayAccessNode: self._eval_array_access,
-            ArrayAssignmentNode: self._eval_array_assignment,
-            UnaryOpNode: self._eval_unary_op,
-            BinaryOpNode: self._eval_binary_op,
-            FunctionCallNode: self._eval_function_call,
-            FunctionDeclarationNode: self._eval_function_declaration,
-            ReturnNode: self._eval_return,
-            VariableDeclarationNode: self._eval_var_declaration,
-            VariableAssignmentNode: self._eval_var_assignment,
-            IfNode: self._eval_if,
-            WhileNode: self._eval_while,
-        }
+        # Run programs on the stack machine instead of the closures
+        self.vm = vm
 
-        self._binary_op_handlers = {
-            TokenType.LOGICAL_AND: lambda left, right: left and right,
-            TokenType.LOGICAL_OR: lambda left, right: left or right,
-            TokenType.EQUAL_EQUAL: lambda left, right: left == right,
-            TokenType.BANG_EQUAL: lambda left, right: left != right,
-            TokenType.GREATER: lambda left, right: left > right,
-            TokenType.LESS: lambda left, right: left < right,
-            TokenType.GREATER_EQUAL: lambda left, right: left >= right,
-            TokenType.LESS_EQUAL: lambda left, right: left <= right,
-            TokenType.PLUS: lambda left, right: left + right,
-            TokenType.MINUS: lambda left, right: left - right,
-            TokenType.MULTIPLY: lambda left, right: left * right,
-            TokenType.DIVIDE: lambda left, right: left / right,
-            TokenType.MODULO: lambda left, right: left % right,
-            TokenType.BIT_OR: lambda left, right: left | right,
-            TokenType.BIT_XOR: lambda left, right: left ^ right,
-            TokenType.BIT_AND: lambda left, right: left & right,
-            TokenType.BIT_LSH: lambda left, right: left << right,
-            TokenType.BIT_RSH: lambda left, right: left >> right,
-        }
+    def compile(self, node) -> Callable:
+        """Compile a node into a closure run as fn(scope)."""
+        compiler = self._COMPILERS.get(type(node))
+        if compiler is None:
+            raise RuntimeError(
+                f"Unsupported node type: {type(node).__name__}",
+                node=node,
+                scope=self.scope,
+            )
+        return compiler(self, node)
 
-        self._eval_cache = {}
+    def compile_block(self, statements) -> List[Callable]:
+        return [self.compile(statement) for statement in statements]
 
-    @lru_cache(maxsize=128)
-    def _get_node_type(self, node):
-        return type(node)
+    def _compile_constant(self, node) -> Callable:
+        value = node.value
 
-    def evaluate(self, node) -> Any:
-        try:
-            node_hash = getattr(node, "__hash__", None)
-            if node_hash is not None:
-                try:
-                    cache_key = (node, id(self.scope))
-                    if cache_key in self._eval_cache:
-                        return self._eval_cache[cache_key]
-                except:
-                    pass
+        def run(scope):
+            return value
 
-            handler = self._node_handlers.get(type(node))
-            if handler:
-                result = handler(node)
+        return run
 
-                if node_hash is not None:
-                    try:
-                        cache_key = (node, id(self.scope))
-                        self._eval_cache[cache_key] = result
-                    except:
-                        pass
+    def _compile_char(self, node) -> Callable:
+        value = chr(node.value)
 
-                return result
+        def run(scope):
+            return value
 
-            raise RuntimeError(
-                f"Unsupported node type: {type(node).__name__}",
-                node=node,
-                scope=self.scope,
-            )
-        except RuntimeError:
-            raise
-        except Exception as e:
-            raise RuntimeError(
-                f"Evaluation error: {str(e)}", node=node, scope=self.scope
-            )
+        return run
 
-    def _eval_number(self, node) -> int:
-        return node.value
+    def _compile_identifier(self, node) -> Callable:
+        name = node.name
 
-    def _eval_float(self, node) -> float:
-        return node.value
+        def run(scope):
+            return scope.lookup(name)
 
-    def _eval_bool(self, node) -> bool:
-        return node.value
+        return run
 
-    def _eval_char(self, node) -> str:
-        return chr(node.value)
+    def _compile_local_ref(self, node) -> Callable:
+        slot = node.slot
 
-    def _eval_string(self, node) -> str:
-        return node.value
+        def run(scope):
+            return scope.slots[slot]
 
-    def _eval_identifier(self, node) -> Any:
-        try:
-            return self.scope.lookup(node.name)
-        except Exception:
-            raise RuntimeError(
-                f"Undefined variable or function: {node.name}",
-                node=node,
-                scope=self.scope,
-            )
+        return run
 
-    def _eval_array(self, node) -> List[Any]:
-        return [self.evaluate(element) for element in node.elements]
+    def _compile_array(self, node) -> Callable:
+        if node._precomputed_list is not None:
+            # Arrays are mutable, so every evaluation gets its own copy
+            precomputed = node._precomputed_list
 
-    def _eval_array_access(self, node) -> Any:
-        array_value = self.evaluate(node.array)
-        index_value = self.evaluate(node.index)
+            def run(scope):
+                return precomputed.copy()
 
-        if not isinstance(array_value, list):
-            raise RuntimeError(
-                f"Expected array, got {type(array_value).__name__}",
-                node=node,
-                scope=self.scope,
-            )
+            return run
 
-        if not isinstance(index_value, int):
-            raise RuntimeError(
-                f"Array index must be an integer, got {type(index_value).__name__}",
-                node=node,
-                scope=self.scope,
-            )
+        elements = self.compile_block(node.elements)
 
-        if index_value < 0 or index_value >= len(array_value):
-            raise RuntimeError(
-                f"Array index out of bounds: {index_value}", node=node, scope=self.scope
-            )
+        def run(scope):
+            return [element(scope) for element in elements]
 
-        return array_value[index_value]
+        return run
 
-    def _eval_array_assignment(self, node) -> Any:
-        array_value = self.evaluate(node.array)
-        index_value = self.evaluate(node.index)
-        assigned_value = self.evaluate(node.value)
+    def _compile_array_access(self, node) -> Callable:
+        array = self.compile(node.array)
+        index = self.compile(node.index)
 
-        if not isinstance(array_value, list):
-            raise RuntimeError(
-                f"Expected array, got {type(array_value).__name__}",
-                node=node,
-                scope=self.scope,
-            )
+        def run(scope):
+            array_value = array(scope)
+            index_value = index(scope)
+            check_array_index(node, scope, array_value, index_value)
+            return array_value[index_value]
 
-        if not isinstance(index_value, int):
-            raise RuntimeError(
-                f"Array index must be an integer, got {type(index_value).__name__}",
-                node=node,
-                scope=self.scope,
-            )
+        return run
 
-        if index_value < 0 or index_value >= len(array_value):
-            raise RuntimeError(
-                f"Array index out of bounds: {index_value}", node=node, scope=self.scope
-            )
+    def _compile_array_assignment(self, node) -> Callable:
+        array = self.compile(node.array)
+        index = self.compile(node.index)
+        value = self.compile(node.value)
 
-        array_value[index_value] = assigned_value
-        return assigned_value
+        def run(scope):
+            array_value = array(scope)
+            index_value = index(scope)
+            assigned_value = value(scope)
+            check_array_index(node, scope, array_value, index_value)
+            array_value[index_value] = assigned_value
+            return assigned_value
 
-    def _eval_unary_op(self, node) -> Any:
-        operand_value = self.evaluate(node.expr)
+        return run
 
-        if node.op == TokenType.PLUS:
-            return +operand_value
-        elif node.op == TokenType.MINUS:
-            return -operand_value
-        elif node.op == TokenType.LOGICAL_NOT:
-            return not operand_value
-        elif node.op == TokenType.BIT_NOT:
-            return ~operand_value
+    def _compile_unary_op(self, node) -> Callable:
+        operation = unary_operators[node.op]
+        operand = self.compile(node.expr)
+        if operation is None:
+            # Only an error once it runs, so code that never does still compiles
+            message = f"Unsupported unary operation: {node.op}"
 
-        raise RuntimeError(
-            f"Unsupported unary operation: {node.op}", node=node, scope=self.scope
-        )
+            def run(scope):
+                operand(scope)
+                raise RuntimeError(message, node=node, scope=scope)
+
+            return run
+
+        def run(scope):
+            return operation(operand(scope))
+
+        return run
+
+    def _compile_binary_op(self, node) -> Callable:
+        op = node.op
+        if op in (TokenType.PLUS_EQUAL, TokenType.MINUS_EQUAL):
+            return self._compile_compound_assignment(node)
+
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        if op == TokenType.LOGICAL_AND:
+
+            def run(scope):
+                if not left(scope):
+                    return False
+                return right(scope)
+
+            return run
 
-    def _eval_binary_op(self, node) -> Any:
-        if node.op in (TokenType.PLUS_EQUAL, TokenType.MINUS_EQUAL):
-            return self._eval_compound_assignment(node)
+        if op == TokenType.LOGICAL_OR:
 
-        if node.op == TokenType.LOGICAL_AND:
-            left_value = self.evaluate(node.left)
-            if not left_value:
-                return False
-            return self.evaluate(node.right)
+            def run(scope):
+                if left(scope):
+                    return True
+                return right(scope)
 
-        if node.op == TokenType.LOGICAL_OR:
-            left_value = self.evaluate(node.left)
-            if left_value:
-                return True
-            return self.evaluate(node.right)
+            return run
 
-        left_value = self.evaluate(node.left)
-        right_value = self.evaluate(node.right)
+        operation = binary_operators[op]
+        if operation is None:
+            message = f"Unsupported binary operation: {op}"
 
-        operation = self._binary_op_handlers.get(node.op)
-        if operation:
+            def run(scope):
+                left(scope)
+                right(scope)
+                raise RuntimeError(message, node=node, scope=scope)
+
+            return run
+
+        if type(node.right) in literal_nodes:
+            # Constant right operand: captured directly instead of called
+            right_value = node.right.value
+
+            def run(scope):
+                left_value = left(scope)
+                try:
+                    return operation(left_value, right_value)
+                except (TypeError, ZeroDivisionError) as e:
+                    raise binary_op_error(node, scope, left_value, right_value, e)
+
+            return run
+
+        def run(scope):
+            left_value = left(scope)
+            right_value = right(scope)
             try:
                 return operation(left_value, right_value)
-            except TypeError:
-                raise RuntimeError(
-                    f"Incompatible types for operation {node.op}: {type(left_value).__name__} and {type(right_value).__name__}",
-                    node=node,
-                    scope=self.scope,
-                )
-            except ZeroDivisionError:
-                raise RuntimeError("Division by zero", node=node, scope=self.scope)
+            except (TypeError, ZeroDivisionError) as e:
+                raise binary_op_error(node, scope, left_value, right_value, e)
 
-        raise RuntimeError(
-            f"Unsupported binary operation: {node.op}", node=node, scope=self.scope
-        )
+        return run
+
+    def _compile_typed_binary_op(self, node) -> Callable:
+        # Both operands are known ints, so no TypeError can occur
+        operation = binary_operators[node.op]
+        left = self.compile(node.left)
+
+        if type(node.right) is NumberNode and node.right.value != 0:
+            # Constant right operand, which also rules out division by zero
+            right_value = node.right.value
+
+            def run(scope):
+                return operation(left(scope), right_value)
 
-    def _eval_compound_assignment(self, node) -> Any:
+            return run
+
+        right = self.compile(node.right)
+
+        if node.checks_zero:
+
+            def run(scope):
+                left_value = left(scope)
+                right_value = right(scope)
+                if right_value == 0:
+                    raise RuntimeError("Division by zero", node=node, scope=scope)
+                return operation(left_value, right_value)
+
+            return run
+
+        if type(node.left) is NumberNode:
+            left_value = node.left.value
+
+            def run(scope):
+                return operation(left_value, right(scope))
+
+            return run
+
+        def run(scope):
+            return operation(left(scope), right(scope))
+
+        return run
+
+    def _compile_compound_assignment(self, node) -> Callable:
         if not isinstance(node.left, IdentifierNode):
             raise RuntimeError(
                 "Left side of compound assignment must be a variable",
@@ -461,99 +622,731 @@ class Runtime:
                 scope=self.scope,
             )
 
-        left_value = self.scope.lookup(node.left.name)
-        right_value = self.evaluate(node.right)
+        name = node.left.name
+        slot = node.left.slot
+        right = self.compile(node.right)
+        load, store = variable_accessors(name, slot)
 
         if node.op == TokenType.PLUS_EQUAL:
-            try:
-                result = left_value + right_value
-            except TypeError:
-                raise RuntimeError(
-                    f"Cannot add {type(left_value).__name__} and {type(right_value).__name__}",
-                    node=node,
-                    scope=self.scope,
-                )
-        elif node.op == TokenType.MINUS_EQUAL:
+
+            def run(scope):
+                left_value = load(scope)
+                right_value = right(scope)
+                try:
+                    result = left_value + right_value
+                except TypeError:
+                    raise RuntimeError(
+                        f"Cannot add {type(left_value).__name__} and {type(right_value).__name__}",
+                        node=node,
+                        scope=scope,
+                    )
+                store(scope, result)
+                return result
+
+            return run
+
+        def run(scope):
+            left_value = load(scope)
+            right_value = right(scope)
             try:
                 result = left_value - right_value
             except TypeError:
                 raise RuntimeError(
                     f"Cannot subtract {type(right_value).__name__} from {type(left_value).__name__}",
                     node=node,
-                    scope=self.scope,
+                    scope=scope,
                 )
+            store(scope, result)
+            return result
+
+        return run
+
+    def _compile_function_call(self, node) -> Callable:
+        name = node.name
+        arguments = self.compile_block(node.arguments)
+
+        if node.slot is not None:
+            load, _ = variable_accessors(name, node.slot)
         else:
-            raise RuntimeError(
-                f"Unsupported compound assignment: {node.op}",
-                node=node,
-                scope=self.scope,
-            )
+            _CALLED_NAMES.add(name)
 
-        self.scope.assign(node.left.name, result)
+            def load(scope):
+                version, cached_scope, func = node.cache
+                if cached_scope is scope and version == Scope._bindings_version:
+                    return func
+                return call_target(node, scope)
 
-        return result
+        if len(arguments) == 1:
+            argument = arguments[0]
 
-    def _eval_function_call(self, node) -> Any:
-        func = self.scope.lookup(node.name)
+            def run(scope):
+                func = load(scope)
 
-        if not isinstance(func, Function):
-            raise RuntimeError(
-                f"Attempted to call a non-callable object: {node.name}",
-                node=node,
-                scope=self.scope,
-            )
+                if type(func) is BuiltInFunction and func.call_one is not None:
+                    return func.call_one(argument(scope))
+                if type(func) is not UserFunction and type(func) is not BuiltInFunction:
+                    not_callable(node, scope)
 
-        arguments = [self.evaluate(arg) for arg in node.arguments]
-        return func(arguments)
+                return func([argument(scope)])
 
-    def _eval_function_declaration(self, node) -> Function:
-        func = UserFunction(node.name, node, self.scope)
-        self.scope.define(node.name, func)
-        return func
+            return run
 
-    def _eval_return(self, node) -> Any:
-        return self.evaluate(node.value)
+        def run(scope):
+            func = load(scope)
 
-    def _eval_var_declaration(self, node) -> Any:
-        value = self.evaluate(node.value)
-        self.scope.define(node.name, value)
-        return value
+            if type(func) is not UserFunction and type(func) is not BuiltInFunction:
+                not_callable(node, scope)
 
-    def _eval_var_assignment(self, node) -> Any:
-        value = self.evaluate(node.value)
-        self.scope.assign(node.name, value)
-        return value
+            return func([argument(scope) for argument in arguments])
 
-    def _eval_if(self, node) -> Any:
-        condition = self.evaluate(node.condition)
-        if condition:
-            runtime = Runtime(Scope(parent=self.scope))
+        return run
+
+    def _compile_function_declaration(self, node) -> Callable:
+        name = node.name
+        # Statements after the first top-level return are never reached
+        statements = node.body[: first_return(node.body) + 1]
+        if node.local_count is None:
+            body = self.compile_block(statements)
+        else:
+            body = [self._compile_body(statements)]
+            kernel = FunctionKernel.lower(node, statements)
+            if kernel is not None:
+                body = [self._compile_kernel_body(node, kernel, body[0])]
+
+        def run(scope):
+            func = UserFunction(name, node, scope)
+            func._prepare(body)
+            scope.define(name, func)
+            return func
+
+        return run
+
+    def _compile_body(self, statements) -> Callable:
+        """Compile a block to one Python function, run with its frame or scope."""
+        generator = BodyGenerator(self.compile)
+        try:
+            source = generator.function(statements)
+            code = compile(source, "<body>", "exec")
+        except (SyntaxError, RecursionError):
+            # Nested past what CPython's compiler accepts, so run the closures
+            return self._compile_statements(statements)
+        _CALLED_NAMES.update(generator.called_names)
+        namespace = dict(globals(), **generator.bindings)
+        exec(code, namespace)
+        return namespace["body"]
+
+    def _compile_statements(self, statements) -> Callable:
+        block = self.compile_block(statements)
+
+        def body(scope):
             result = None
-            for stmt in node.body:
-                result = runtime.evaluate(stmt)
+            for statement in block:
+                result = statement(scope)
             return result
-        return None
 
-    def _eval_while(self, node) -> None:
-        result = None
-        while_scope = Scope(parent=self.scope)
-        while_runtime = Runtime(while_scope)
+        return body
+
+    @staticmethod
+    def _compile_kernel_body(node, kernel, interpret) -> Callable:
+        argc = len(node.arguments)
+
+        def run(frame):
+            # Calls the kernel can't take run the generated body, which also
+            # reports any error
+            values = frame.slots[:argc]
+            for value in values:
+                if type(value) is not int:
+                    return interpret(frame)
+            status, result = kernel(values)
+            if status == DONE:
+                return result
+            return interpret(frame)
+
+        return run
+
+    def _compile_return(self, node) -> Callable:
+        return self.compile(node.value)
+
+    def _compile_var_declaration(self, node) -> Callable:
+        name = node.name
+        slot = node.slot
+        value = self.compile(node.value)
+
+        if slot is not None:
+
+            def run(scope):
+                result = scope.slots[slot] = value(scope)
+                return result
+
+            return run
+
+        def run(scope):
+            result = value(scope)
+            scope.define(name, result)
+            return result
+
+        return run
+
+    def _compile_var_assignment(self, node) -> Callable:
+        value = self.compile(node.value)
+        _, store = variable_accessors(node.name, node.slot)
+
+        def run(scope):
+            result = value(scope)
+            store(scope, result)
+            return result
+
+        return run
+
+    @staticmethod
+    def _acquire_scope(parent) -> Scope:
+        if Runtime._scope_pool:
+            scope = Runtime._scope_pool.pop()
+            if scope.parent is not parent:
+                # Lookups from this scope now go through another chain
+                scope.parent = parent
+                Scope._bindings_version += 1
+            scope.slots = parent.slots
+            return scope
+        return Scope(parent=parent)
+
+    @staticmethod
+    def _release_scope(scope) -> None:
+        # The parent is kept so reacquiring under it keeps call-site caches
+        if len(Runtime._scope_pool) < SCOPE_POOL_SIZE:
+            if scope.symbols:
+                scope.clear()
+            scope._cached_lookups.clear()
+            Runtime._scope_pool.append(scope)
+
+    @staticmethod
+    def _block_scope_hooks(node):
+        # Blocks that declare nothing share the enclosing scope, and blocks
+        # no function can capture reuse scopes from the pool
+        if not node._introduces_scope:
+            return None, None
+        if node._captures_scope:
+            return Scope, None
+        return Runtime._acquire_scope, Runtime._release_scope
+
+    def _compile_if(self, node) -> Callable:
+        condition = self.compile(node.condition)
+        body = self.compile_block(node.body)
+        else_body = None
+        if node.else_body is not None:
+            else_body = self.compile_block(node.else_body)
+        enter, leave = self._block_scope_hooks(node)
+
+        def run(scope):
+            block = body if condition(scope) else else_body
+            if block is None:
+                return None
+
+            block_scope = enter(scope) if enter else scope
+            result = None
+            for statement in block:
+                result = statement(block_scope)
+            if leave:
+                leave(block_scope)
+            return result
+
+        return run
+
+    def _compile_while(self, node) -> Callable:
+        condition = self.compile(node.condition)
+        # A return in the loop body ends the loop after that statement, so
+        # such a loop runs its body at most once
+        return_index = first_return(node.body)
+        returns = return_index < len(node.body)
+        body = self.compile_block(node.body[: return_index + 1])
+        enter, leave = self._block_scope_hooks(node)
+
+        if returns:
+
+            def run(scope):
+                loop_scope = enter(scope) if enter else scope
+                result = None
+                if condition(loop_scope):
+                    for statement in body:
+                        result = statement(loop_scope)
+                if leave:
+                    leave(loop_scope)
+                return result
+
+            return run
 
-        iteration = 0
-        while while_runtime.evaluate(node.condition):
+        def run(scope):
+            loop_scope = enter(scope) if enter else scope
             result = None
-            for stmt in node.body:
-                result = while_runtime.evaluate(stmt)
-                if isinstance(stmt, ReturnNode):
-                    return result
-            iteration += 1
-            if iteration > 1000:
+
+            iteration = 0
+            while condition(loop_scope):
+                result = None
+                for statement in body:
+                    result = statement(loop_scope)
+                iteration += 1
+                if iteration > 1000:
+                    raise RuntimeError("Maximum iteration limit reached")
+
+            if leave:
+                leave(loop_scope)
+            return result
+
+        kernel = LoopKernel.lower(node)
+        if kernel is None:
+            return run
+
+        loaders = self.compile_block(kernel.inputs)
+        interpret = run
+
+        def run(scope):
+            # Anything the kernel can't run as-is goes to the interpreter,
+            # which also reports any error
+            try:
+                values = [load(scope) for load in loaders]
+            except RuntimeError:
+                return interpret(scope)
+            for value in values:
+                if type(value) is not int:
+                    return interpret(scope)
+
+            status, ran, last = kernel(values)
+            if status == DONE:
+                return last if ran else None
+            if status == LIMIT:
                 raise RuntimeError("Maximum iteration limit reached")
+            return interpret(scope)
 
-        return result
+        return run
+
+    def compile_code(self, statements) -> Code:
+        try:
+            return Compiler(_CALLED_NAMES).program(statements)
+        except CompileError as e:
+            raise RuntimeError(e.message, node=e.node, scope=self.scope)
+
+    def run_code(self, code: Code, scope: Scope) -> Any:
+        """
+        Run compiled code on an explicit operand stack.
+
+        Calls to functions made by the code push the caller's registers on
+        `calls` and continue in the callee's code, so the depth of user
+        recursion is not bounded by the Python stack.
+        """
+        ops, args, consts, names = code.ops, code.args, code.consts, code.names
+        pc = 0
+        func = None
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        calls = []
+        handlers = vm_handlers
+
+        try:
+            while True:
+                op = ops[pc]
+                arg = args[pc]
+                pc += 1
+
+                if op == LOAD_LOCAL:
+                    push(scope.slots[arg])
+                elif op == LOAD_CONST:
+                    push(consts[arg])
+                elif op == LOAD_NAME:
+                    push(scope.lookup(names[arg]))
+                elif op == BINARY_INT_CONST:
+                    operation, right = consts[arg]
+                    stack[-1] = operation(stack[-1], right)
+                elif op == BINARY_INT:
+                    right = pop()
+                    stack[-1] = consts[arg](stack[-1], right)
+                elif op == BINARY_CONST:
+                    operation, node, right = consts[arg]
+                    left = stack[-1]
+                    try:
+                        stack[-1] = operation(left, right)
+                    except (TypeError, ZeroDivisionError) as e:
+                        raise binary_op_error(node, scope, left, right, e)
+                elif op == BINARY:
+                    operation, node = consts[arg]
+                    right = pop()
+                    left = stack[-1]
+                    try:
+                        stack[-1] = operation(left, right)
+                    except (TypeError, ZeroDivisionError) as e:
+                        raise binary_op_error(node, scope, left, right, e)
+                elif op == LOOP_TEST:
+                    # The condition, then the previous iteration's result
+                    if pop():
+                        pop()
+                    else:
+                        pc = arg
+                elif op == JUMP_IF_FALSE:
+                    if not pop():
+                        pc = arg
+                elif op == POP_TOP:
+                    pop()
+                elif op == JUMP:
+                    pc = arg
+                elif op == STORE_LOCAL_POP:
+                    scope.slots[arg] = pop()
+                elif op == DEFINE_NAME_POP:
+                    scope.define(names[arg], pop())
+                elif op == LOOP_NEXT:
+                    stack[-2] += 1
+                    if stack[-2] > 1000:
+                        raise RuntimeError("Maximum iteration limit reached")
+                    pc = arg
+                elif op == STORE_LOCAL:
+                    scope.slots[arg] = stack[-1]
+                elif op == DEFINE_NAME:
+                    scope.define(names[arg], stack[-1])
+                elif op >= FIRST_HANDLED:
+                    handlers[op](stack, arg, consts, names, scope)
+                elif op == CALL:
+                    base = len(stack) - arg
+                    callee = stack[base - 1]
+                    if type(callee) is BuiltInFunction:
+                        if arg == 1 and callee.call_one is not None:
+                            result = callee.call_one(pop())
+                        else:
+                            result = callee(stack[base:])
+                            del stack[base:]
+                        stack[-1] = result
+                    elif callee._code is None:
+                        result = callee(stack[base:])
+                        del stack[base:]
+                        stack[-1] = result
+                    else:
+                        if len(calls) >= MAX_CALL_DEPTH:
+                            raise RuntimeError(
+                                "Evaluation error: maximum recursion depth exceeded",
+                                scope=self.scope,
+                                func=callee,
+                            )
+                        frame = callee._enter_frame(stack[base:])
+                        del stack[base - 1 :]
+                        calls.append((ops, args, consts, names, pc, scope, func))
+                        code = callee._code
+                        ops, args, consts, names = (
+                            code.ops,
+                            code.args,
+                            code.consts,
+                            code.names,
+                        )
+                        pc = 0
+                        scope = frame
+                        func = callee
+                elif op == RETURN:
+                    result = pop()
+                    func._leave_frame(scope)
+                    ops, args, consts, names, pc, scope, func = calls.pop()
+                    push(result if result is not None else 0)
+                elif op == ENTER_SCOPE:
+                    if arg == FRESH_SCOPE:
+                        scope = Scope(parent=scope)
+                    else:
+                        scope = Runtime._acquire_scope(scope)
+                elif op == LEAVE_SCOPE:
+                    block_scope = scope
+                    scope = block_scope.parent
+                    if arg == POOLED_SCOPE:
+                        Runtime._release_scope(block_scope)
+                elif op == AND_JUMP:
+                    if stack[-1]:
+                        pop()
+                    else:
+                        stack[-1] = False
+                        pc = arg
+                elif op == OR_JUMP:
+                    if stack[-1]:
+                        stack[-1] = True
+                        pc = arg
+                    else:
+                        pop()
+                elif op == HALT:
+                    return pop()
+        except RuntimeError as e:
+            if e.func is None:
+                e.func = func
+            raise
+        except Exception as e:
+            if func is None:
+                raise
+            raise RuntimeError(
+                f"Evaluation error: {str(e)}", scope=self.scope, func=func
+            )
 
     def execute(self, statements) -> Any:
-        result = None
-        for statement in statements:
-            result = self.evaluate(statement)
+        # The only exception handler on the closure evaluation path, which
+        # also covers compiling the program
+        try:
+            if self.vm:
+                result = self.run_code(self.compile_code(statements), self.scope)
+            else:
+                # The program itself runs as generated Python, like function bodies
+                result = self._compile_body(statements)(self.scope)
+        except RuntimeError as e:
+            if e.func is None:
+                e.func = failing_function(e.__traceback__)
+            raise
+        except Exception as e:
+            raise RuntimeError(
+                f"Evaluation error: {str(e)}",
+                scope=self.scope,
+                func=failing_function(e.__traceback__),
+            )
         return result
+
+    # Node type -> compiler, built once after every compiler is defined
+    _COMPILERS = {
+        NumberNode: _compile_constant,
+        FloatNumberNode: _compile_constant,
+        BoolNode: _compile_constant,
+        CharNode: _compile_char,
+        StringNode: _compile_constant,
+        IdentifierNode: _compile_identifier,
+        LocalRefNode: _compile_local_ref,
+        ArrayNode: _compile_array,
+        ArrayAccessNode: _compile_array_access,
+        ArrayAssignmentNode: _compile_array_assignment,
+        UnaryOpNode: _compile_unary_op,
+        BinaryOpNode: _compile_binary_op,
+        TypedBinaryOpNode: _compile_typed_binary_op,
+        FunctionCallNode: _compile_function_call,
+        FunctionDeclarationNode: _compile_function_declaration,
+        ReturnNode: _compile_return,
+        VariableDeclarationNode: _compile_var_declaration,
+        VariableAssignmentNode: _compile_var_assignment,
+        IfNode: _compile_if,
+        WhileNode: _compile_while,
+    }
+
+
+def binary_op_error(node, scope, left_value, right_value, error) -> RuntimeError:
+    if isinstance(error, ZeroDivisionError):
+        return RuntimeError("Division by zero", node=node, scope=scope)
+    return RuntimeError(
+        f"Incompatible types for operation {node.op}: {type(left_value).__name__} and {type(right_value).__name__}",
+        node=node,
+        scope=scope,
+    )
+
+
+def variable_accessors(name, slot):
+    """Build (load, store) functions for a name, using its slot when resolved."""
+    if slot is None:
+
+        def load(scope):
+            return scope.lookup(name)
+
+        def store(scope, value):
+            scope.assign(name, value)
+
+        return load, store
+
+    def load(scope):
+        return scope.slots[slot]
+
+    def store(scope, value):
+        scope.slots[slot] = value
+        print(f"{name} = {value}")
+
+    return load, store
+
+
+def failing_function(traceback) -> Optional[UserFunction]:
+    """The innermost user function call on a traceback, if any."""
+    func = None
+    call_code = UserFunction.__call__.__code__
+    while traceback is not None:
+        frame = traceback.tb_frame
+        if frame.f_code is call_code:
+            func = frame.f_locals["self"]
+        traceback = traceback.tb_next
+    return func
+
+
+def call_target(node, scope) -> Any:
+    """Look up a call site's callee and remember it in the site's cache."""
+    func = scope.lookup(node.name)
+    node.cache = (Scope._bindings_version, scope, func)
+    return func
+
+
+def not_callable(node, scope):
+    raise RuntimeError(
+        f"Attempted to call a non-callable object: {node.name}",
+        node=node,
+        scope=scope,
+    )
+
+
+def load_item(node, scope, array_value, index_value) -> Any:
+    check_array_index(node, scope, array_value, index_value)
+    return array_value[index_value]
+
+
+def store_item(node, scope, array_value, index_value, value) -> Any:
+    check_array_index(node, scope, array_value, index_value)
+    array_value[index_value] = value
+    return value
+
+
+def check_array_index(node, scope, array_value, index_value) -> None:
+    if type(array_value) is not list:
+        raise RuntimeError(
+            f"Expected array, got {type(array_value).__name__}",
+            node=node,
+            scope=scope,
+        )
+
+    # Comparisons produce bools, which Python also accepts as indices
+    if type(index_value) is not int and type(index_value) is not bool:
+        raise RuntimeError(
+            f"Array index must be an integer, got {type(index_value).__name__}",
+            node=node,
+            scope=scope,
+        )
+
+    if index_value < 0 or index_value >= len(array_value):
+        raise RuntimeError(
+            f"Array index out of bounds: {index_value}", node=node, scope=scope
+        )
+
+
+# Stack machine instructions that don't touch its registers, each run as
+# handler(stack, arg, consts, names, scope)
+
+
+def op_assign_local(stack, arg, consts, names, scope) -> None:
+    name, slot = consts[arg]
+    value = scope.slots[slot] = stack[-1]
+    print(f"{name} = {value}")
+
+
+def op_assign_name(stack, arg, consts, names, scope) -> None:
+    scope.assign(names[arg], stack[-1])
+
+
+def op_loop_tick(stack, arg, consts, names, scope) -> None:
+    # The loop's iteration count sits under its result
+    stack[-2] += 1
+    if stack[-2] > 1000:
+        raise RuntimeError("Maximum iteration limit reached")
+
+
+def op_loop_exit(stack, arg, consts, names, scope) -> None:
+    del stack[-2]
+
+
+def op_get_callee(stack, arg, consts, names, scope) -> None:
+    node = consts[arg]
+    if node.slot is not None:
+        callee = scope.slots[node.slot]
+    else:
+        version, cached_scope, callee = node.cache
+        if cached_scope is not scope or version != Scope._bindings_version:
+            callee = call_target(node, scope)
+    if type(callee) is not UserFunction and type(callee) is not BuiltInFunction:
+        not_callable(node, scope)
+    stack.append(callee)
+
+
+def op_binary_int_checked(stack, arg, consts, names, scope) -> None:
+    operation, node = consts[arg]
+    right = stack.pop()
+    if right == 0:
+        raise RuntimeError("Division by zero", node=node, scope=scope)
+    stack[-1] = operation(stack[-1], right)
+
+
+def op_unary(stack, arg, consts, names, scope) -> None:
+    stack[-1] = consts[arg](stack[-1])
+
+
+def op_array_get(stack, arg, consts, names, scope) -> None:
+    index = stack.pop()
+    stack[-1] = load_item(consts[arg], scope, stack[-1], index)
+
+
+def op_array_set(stack, arg, consts, names, scope) -> None:
+    value = stack.pop()
+    index = stack.pop()
+    stack[-1] = store_item(consts[arg], scope, stack[-1], index, value)
+
+
+def op_copy_const(stack, arg, consts, names, scope) -> None:
+    stack.append(consts[arg].copy())
+
+
+def op_build_array(stack, arg, consts, names, scope) -> None:
+    base = len(stack) - arg
+    elements = stack[base:]
+    del stack[base:]
+    stack.append(elements)
+
+
+def op_inplace_add(stack, arg, consts, names, scope) -> None:
+    right = stack.pop()
+    left = stack[-1]
+    try:
+        stack[-1] = left + right
+    except TypeError:
+        raise RuntimeError(
+            f"Cannot add {type(left).__name__} and {type(right).__name__}",
+            node=consts[arg],
+            scope=scope,
+        )
+
+
+def op_inplace_sub(stack, arg, consts, names, scope) -> None:
+    right = stack.pop()
+    left = stack[-1]
+    try:
+        stack[-1] = left - right
+    except TypeError:
+        raise RuntimeError(
+            f"Cannot subtract {type(right).__name__} from {type(left).__name__}",
+            node=consts[arg],
+            scope=scope,
+        )
+
+
+def op_make_function(stack, arg, consts, names, scope) -> None:
+    node, body = consts[arg]
+    function = UserFunction(node.name, node, scope)
+    function._prepare(None, body)
+    scope.define(node.name, function)
+    stack.append(function)
+
+
+def op_fail(stack, arg, consts, names, scope) -> None:
+    message, node = consts[arg]
+    raise RuntimeError(message, node=node, scope=scope)
+
+
+vm_handlers = [None] * (FAIL + 1)
+vm_handlers[ASSIGN_LOCAL] = op_assign_local
+vm_handlers[ASSIGN_NAME] = op_assign_name
+vm_handlers[LOOP_TICK] = op_loop_tick
+vm_handlers[LOOP_EXIT] = op_loop_exit
+vm_handlers[GET_CALLEE] = op_get_callee
+vm_handlers[BINARY_INT_CHECKED] = op_binary_int_checked
+vm_handlers[UNARY] = op_unary
+vm_handlers[ARRAY_GET] = op_array_get
+vm_handlers[ARRAY_SET] = op_array_set
+vm_handlers[COPY_CONST] = op_copy_const
+vm_handlers[BUILD_ARRAY] = op_build_array
+vm_handlers[INPLACE_ADD] = op_inplace_add
+vm_handlers[INPLACE_SUB] = op_inplace_sub
+vm_handlers[MAKE_FUNCTION] = op_make_function
+vm_handlers[FAIL] = op_fail
+vm_handlers = tuple(vm_handlers)
+
+
+def join_args(args) -> str:
+    """Concatenate builtin arguments as strings, without a generator frame."""
+    if len(args) == 1:
+        return str(args[0])
+    return "".join(map(str, args))
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+import io
+import os
+import re
+import sys
+import time
+from contextlib import redirect_stdout
+
+import jit
+import runtime
+from main import compile_source
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+
+def nested_whiles(depth):
+    lines = ["fn f() {", "var i = 0"]
+    for level in range(depth):
+        lines.append(f"while (i < {level + 1}) {{")
+        lines.append("i = i + 1")
+    lines += ["}"] * depth
+    lines += ["return i", "}", "print(f())"]
+    return "\n".join(lines)
+
+
+def nested_ifs(depth):
+    lines = ["fn f(a) {"]
+    lines += [f"if (a > {level}) {{" for level in range(depth)]
+    lines.append("print(a)")
+    lines += ["}"] * depth
+    lines += ["return a", "}", "print(f(200))"]
+    return "\n".join(lines)
+
+
+def long_sum(terms):
+    return " + ".join(["x"] * terms)
+
+
+def example(name):
+    with open(os.path.join(EXAMPLES, name)) as file:
+        return file.read()
+
+
+def fake_njit(function):
+    """Stands in for numba's njit, whose dispatcher only takes int64 ints."""
+
+    def dispatch(*args):
+        for arg in args:
+            if not -(1 << 63) <= arg < 1 << 63:
+                raise OverflowError("int too big to convert")
+        return function(*args)
+
+    return dispatch
+
+
+def run_program(src, vm, stdin="", njit=None):
+    """Run a program on one engine and return everything it printed."""
+    output = io.StringIO()
+    old_stdin, old_njit = sys.stdin, jit.njit
+    sys.stdin = io.StringIO(stdin)
+    if njit is not None:
+        jit.njit = njit
+    try:
+        with redirect_stdout(output):
+            r = runtime.Runtime(runtime.GlobalScope(), vm)
+            try:
+                r.execute(compile_source(src, r.scope))
+            except runtime.RuntimeError as e:
+                print(f"{e}")
+    finally:
+        sys.stdin, jit.njit = old_stdin, old_njit
+    # Scope addresses differ between runs
+    return re.sub(r"0x[0-9a-f]+", "0x?", output.getvalue())
+
+
+def run_tests():
+    # (name, source, stdin, expected output or None, category). Every
+    # program runs on both engines, which have to print the same thing
+    test_cases = [
+        # Examples
+        ("hello.prgm", example("hello.prgm"), "", None, "example"),
+        ("funcs.prgm", example("funcs.prgm"), "", None, "example"),
+        ("loops.prgm", example("loops.prgm"), "", None, "example"),
+        ("test.prgm", example("test.prgm"), "", None, "example"),
+        ("arrays.prgm", example("arrays.prgm"), "", None, "example"),
+        ("full.prgm", example("full.prgm"), "", None, "example"),
+        ("fizzbuzz.prgm", example("fizzbuzz.prgm"), "15\n", None, "example"),
+        ("if.prgm", example("if.prgm"), "Kevin\n", None, "example"),
+        # Deep nesting, past what generated Python source can express
+        (
+            "long sum in fn",
+            f"fn f() {{\nvar x = 1\nprint({long_sum(210)})\n}}\nf()",
+            "",
+            "210\n",
+            "nesting",
+        ),
+        (
+            "long sum at top",
+            f"var x = 1\nprint({long_sum(210)})",
+            "",
+            "210\n",
+            "nesting",
+        ),
+        ("25 nested whiles", nested_whiles(25), "", None, "nesting"),
+        ("110 nested ifs", nested_ifs(110), "", "200\n200\n", "nesting"),
+        # Big literals
+        (
+            "big folded int",
+            "var y = 3\nprint(((1 << 20000) + y) % 7)",
+            "",
+            "0\n",
+            "literals",
+        ),
+        (
+            "big int in fn",
+            "fn f() {\nvar y = 3\nreturn ((1 << 20000) + y) % 7\n}\nprint(f())",
+            "",
+            "0\n",
+            "literals",
+        ),
+        ("big int var", "var x = 1 << 20000\nprint(x % 7)", "", "4\n", "literals"),
+        (
+            "huge shift never run",
+            'fn never() {\nreturn 1 << 100000000000\n}\nprint("start")',
+            "",
+            "start\n",
+            "literals",
+        ),
+        (
+            "float overflow",
+            f"fn f() {{\nreturn {'9' * 400}.0\n}}\nprint(f())\nprint({'9' * 400}.0)",
+            "",
+            "inf\ninf\n",
+            "literals",
+        ),
+        (
+            "signed zeros",
+            "print(0.0)\nprint(-0.0)\nprint(0)",
+            "",
+            "0.0\n-0.0\n0\n",
+            "literals",
+        ),
+        # Closures over pooled frames
+        (
+            "shadowed var",
+            "var x = 1\nfn outer() {\nfn f() {\nreturn x\n}\nprint(f())\n"
+            "var x = 2\nprint(f())\n}\nouter()",
+            "",
+            "1\n2\n",
+            "frames",
+        ),
+        (
+            "redefined fn",
+            "fn g() {\nreturn 1\n}\nfn outer() {\nfn f() {\nreturn g()\n}\n"
+            "print(f())\nfn g() {\nreturn 2\n}\nprint(f())\n}\nouter()",
+            "",
+            "1\n2\n",
+            "frames",
+        ),
+        (
+            "repeated calls",
+            "fn f(n) {\nvar a = n * 2\nreturn a + 1\n}\nvar i = 0\n"
+            "while (i < 5) {\nprint(f(i))\ni = i + 1\n}",
+            "",
+            "1\ni = 1\n3\ni = 2\n5\ni = 3\n7\ni = 4\n9\ni = 5\n",
+            "frames",
+        ),
+        (
+            "recursion",
+            # A return inside an if doesn't leave the function
+            "fn fib(n) {\nvar r = n\nif (n > 1) {\nr = fib(n - 1) + fib(n - 2)\n}\n"
+            "return r\n}\nprint(fib(10))",
+            "",
+            None,
+            "frames",
+        ),
+        # Loops echo every assignment and stop after 1000 iterations
+        (
+            "loop echo",
+            "var i = 0\nvar s = 0\nwhile (i < 3) {\ni = i + 1\ns += i\n}\nprint(s)",
+            "",
+            "i = 1\ns = 1\ni = 2\ns = 3\ni = 3\ns = 6\n6\n",
+            "loops",
+        ),
+        (
+            "iteration limit",
+            "var i = 0\nwhile (1) {\ni += 1\n}",
+            "",
+            "".join(f"i = {i}\n" for i in range(1, 1002))
+            + "RuntimeError in scope at 0x?: Maximum iteration limit reached\n",
+            "loops",
+        ),
+        (
+            "iteration limit in fn",
+            "fn spin() {\nvar i = 0\nwhile (i < 2000) {\ni = i + 1\n}\n}\nspin()",
+            "",
+            "".join(f"i = {i}\n" for i in range(1, 1002))
+            + "RuntimeError in scope at 0x? in function 'spin':"
+            " Maximum iteration limit reached\n",
+            "loops",
+        ),
+        # Literal conditions are resolved at compile time, where the text of
+        # a bool literal is always true and an empty string is false
+        (
+            "pruned ifs",
+            'if (1) {\nprint("one")\n} else {\nprint("zero")\n}\n'
+            'if (0) {\nprint("never")\n}\n'
+            'if (false) {\nprint("false is text")\n}\n'
+            'while (0) {\nprint("never")\n}\n'
+            "fn f() {\nif (1) {\nvar x = 5\n}\nreturn 2\n}\nprint(f())\n"
+            'if ("") {\nprint("empty")\n} else {\nprint("no text")\n}',
+            "",
+            "one\nfalse is text\n2\nno text\n",
+            "pruning",
+        ),
+        (
+            "pruned if keeps its scope",
+            "var x = 1\nif (1) {\nvar x = 2\nprint(x)\n}\nprint(x)",
+            "",
+            "2\n1\n",
+            "pruning",
+        ),
+        # Builtins shadowed in a block keep their own type outside it
+        (
+            "shadowed PI",
+            "if (1) {\nvar PI = 3\n}\nprint(PI | 1)",
+            "",
+            "RuntimeError in scope at 0x?:"
+            " Incompatible types for operation BIT_OR: float and int\n",
+            "builtins",
+        ),
+        (
+            "shadowed len",
+            "fn f() {\nvar len = 2\nreturn len + 1\n}\nprint(f())\n"
+            "print(len([1, 2, 3]))\nprint(len + 1)",
+            "",
+            "3\n3\nRuntimeError in scope at 0x?:"
+            " Incompatible types for operation PLUS: BuiltInFunction and int\n",
+            "builtins",
+        ),
+        # Errors
+        (
+            "unsupported op never run",
+            'fn never() {\nreturn 1 ~ 2\n}\nprint("start")',
+            "",
+            "start\n",
+            "errors",
+        ),
+        (
+            "unsupported op run",
+            "fn later() {\nreturn 3 ~ 4\n}\nlater()",
+            "",
+            "RuntimeError in scope at 0x? in function 'later':"
+            " Unsupported binary operation: BIT_NOT\n",
+            "errors",
+        ),
+        (
+            "python error in fn",
+            "fn f(a) {\nreturn a << -1\n}\nprint(f(1))",
+            "",
+            "RuntimeError in scope at 0x? in function 'f':"
+            " Evaluation error: negative shift count\n",
+            "errors",
+        ),
+        (
+            "division by zero",
+            "var a = 0\nprint(1 / a)",
+            "",
+            "RuntimeError in scope at 0x?: Division by zero\n",
+            "errors",
+        ),
+        (
+            "bad types",
+            'print(1 + "a")',
+            "",
+            "RuntimeError in scope at 0x?:"
+            " Incompatible types for operation PLUS: int and str\n",
+            "errors",
+        ),
+        (
+            "index out of bounds",
+            "var a = [1, 2]\nprint(a[2])",
+            "",
+            "RuntimeError in scope at 0x?: Array index out of bounds: 2\n",
+            "errors",
+        ),
+        (
+            "undefined name",
+            "print(missing)",
+            "",
+            "RuntimeError in scope at 0x?: Undefined variable or function: missing\n",
+            "errors",
+        ),
+        (
+            "runaway recursion",
+            # Never stops, as the return inside the if doesn't leave fact
+            "fn fact(n) {\nif (n < 2) {\nreturn 1\n}\nreturn n * fact(n - 1)\n}\n"
+            "print(fact(5))",
+            "",
+            "RuntimeError in scope at 0x? in function 'fact':"
+            " Evaluation error: maximum recursion depth exceeded\n",
+            "errors",
+        ),
+    ]
+
+    # Recursion past the Python stack only runs on the stack machine
+    vm_cases = [
+        (
+            "deep recursion",
+            "fn down(n) {\nvar r = 0\nif (n > 0) {\nr = down(n - 1) + 1\n}\n"
+            "return r\n}\nprint(down(3000))",
+            "",
+            "".join(f"r = {depth}\n" for depth in range(1, 3001)) + "3000\n",
+            "vm",
+        ),
+    ]
+
+    # Run with a stand-in for numba, so hot loops and functions are handed
+    # to compiled kernels and have to fall back for ints they can't take
+    kernel_cases = [
+        (
+            "function kernel",
+            "fn sq(a) {\nvar b = a * a\nreturn b + 1\n}\nvar k = 0\n"
+            "while (k < 100) {\nvar t = sq(k)\nk += 1\n}\n"
+            "print(sq(12))\nprint(sq(1 << 40))\nprint(sq(1 << 70))",
+            "",
+            "".join(f"k = {k}\n" for k in range(1, 101))
+            + "145\n1208925819614629174706177\n"
+            "1393796574908163946345982392040522594123777\n",
+            "kernels",
+        ),
+        (
+            "loop kernel",
+            # The loop is the last statement, so its value is the result
+            "fn add(n) {\nvar i = 0\nvar s = n\nwhile (i < 3) {\n"
+            "var i = i + 1\nvar s = s + i\n}\n}\nvar k = 0\n"
+            "while (k < 100) {\nvar t = add(k)\nk += 1\n}\n"
+            "print(add(4))\nprint(add(1 << 40))\nprint(add(1 << 70))",
+            "",
+            "".join(f"k = {k}\n" for k in range(1, 101))
+            + "10\n1099511627782\n1180591620717411303430\n",
+            "kernels",
+        ),
+    ]
+
+    cases = [(case, "both") for case in test_cases]
+    cases += [(case, "vm") for case in vm_cases]
+    cases += [(case, "kernel") for case in kernel_cases]
+
+    passed = 0
+    failed = 0
+    total_time = 0.0
+
+    print("Running tests...\n")
+
+    for (name, src, stdin, expected, category), engines in cases:
+        start = time.perf_counter()
+        try:
+            vm = run_program(src, vm=True, stdin=stdin)
+            closures = vm
+            if engines != "vm":
+                njit = fake_njit if engines == "kernel" else None
+                closures = run_program(src, vm=False, stdin=stdin, njit=njit)
+            duration = (time.perf_counter() - start) * 1000
+
+            if closures != vm:
+                print(
+                    f"\033[91m❌ FAIL\033[0m [{category:>10}] {name:<30} → Engines disagree:\n"
+                    f"  closures: {closures!r}\n  vm:       {vm!r} ({duration:.2f}ms)"
+                )
+                failed += 1
+            elif expected is not None and closures != expected:
+                print(
+                    f"\033[91m❌ FAIL\033[0m [{category:>10}] {name:<30} → Expected {expected!r}, got {closures!r} ({duration:.2f}ms)"
+                )
+                failed += 1
+            else:
+                print(
+                    f"\033[92m✅ PASS\033[0m [{category:>10}] {name:<30} ({duration:.2f}ms)"
+                )
+                passed += 1
+        except Exception as e:
+            duration = (time.perf_counter() - start) * 1000
+            print(
+                f"\033[91m❌ FAIL\033[0m [{category:>10}] {name:<30} → Unexpected error: {e!r} ({duration:.2f}ms)"
+            )
+            failed += 1
+
+        total_time += duration
+
+    print("\n=== Test Summary ===")
+    print(f"✅ Passed: {passed}")
+    print(f"❌ Failed: {failed}")
+    print(f"⏱️  Total Time: {total_time:.2f}ms")
+    print(
+        f"📊 Total Tests: {passed + failed} ({(passed / (passed + failed)) * 100:.1f}% passed)"
+    )
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run_tests() else 0)